@@ -1,4 +1,6 @@
+import tempfile
 from pathlib import Path
+from typing import Optional
 
 from pydantic import BaseSettings
 
@@ -7,8 +9,16 @@ class Settings(BaseSettings):
     minio_host: str = "minio:9000"
     minio_access_key: str = "minioadmin"
     minio_secret_key: str = "minioadmin"
+    minio_pool_size: int = 32
+    minio_transfer_workers: int = 8
+    minio_metadata_ttl: float = 60
     default_thresholds: float = 0.3
     dpi: int = 300
+    detection_dpi: Optional[int] = None
+    detection_max_side: int = 0
+    tile_size: int = 0
+    tile_overlap: int = 200
+    tile_nms_iou: float = 0.5
     inch_to_point: int = 72
     image_format: str = "png"
     data_bucket: str = "test"
@@ -17,6 +27,44 @@ class Settings(BaseSettings):
     config_file: str = "latex-detector.py"
     model_name: str = "latex-detector"
     device: str = "cpu"
+    load_on_startup: bool = True
+    warm_up: bool = True
+    batch_size: int = 4
+    in_memory_pipeline: bool = False
+    cache_rendered_images: bool = True
+    write_behind_workers: int = 2
+    write_behind_queue_size: int = 4
+    render_workers: int = 1
+    job_workers: int = 2
+    job_queue_size: int = 32
+    job_history_size: int = 1000
+    save_partial_results: bool = False
+    pages_in_flight: int = 16
+    admission_max_pages: int = 64
+    admission_max_bytes: int = 2 * 1024**3
+    admission_timeout: float = 30
+    result_cache_size: int = 1024
+    result_cache_ttl: float = 24 * 60 * 60
+    result_cache_bucket: Optional[str] = None
+    result_cache_prefix: str = "detection_cache"
+    inference_backend: str = "eager"
+    quantize_dynamic: bool = False
+    inference_workers: int = 0
+    inference_worker_threads: int = 0
+    scheduler_enabled: bool = False
+    scheduler_max_batch_size: int = 8
+    scheduler_max_wait_ms: int = 10
+    verbose_workers: int = 1
+    verbose_queue_size: int = 4
+    verbose_page_step: int = 1
+    verbose_max_pages: int = 20
     host: str = "0.0.0.0"
     port: int = 8000
     log_file: str = str(Path(__file__).parent.joinpath("inference.log"))
+    model_cache_dir: str = str(
+        Path(tempfile.gettempdir()).joinpath("latex-model-cache")
+    )
+    model_cache_max_bytes: int = 2 * 1024**3
+    scratch_dir: Optional[str] = None
+    scratch_quota_bytes: int = 2 * 1024**3
+    scratch_prefer_tmpfs: bool = True
@@ -1,19 +1,72 @@
 import json
-import tempfile
-import uuid
+import math
+import threading
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
-from cv2 import cv2
-from mmcv import Config
-from mmdet.apis import inference_detector, init_detector
+import numpy as np
+from minio.error import S3Error
 
 from .config import Settings
 from .schemas import Predict, Size
-from .utils.extraction import extract_boxes_from_result, prepare_response
+from .utils.admission import AdmissionLease, admission
+from .utils.background import BoundedExecutor
+from .utils.detection_cache import DetectionCache
+from .utils.extraction import (
+    OBJECTS_FORMAT,
+    extract_boxes_from_result,
+    prepare_response,
+)
+from .utils.images import (
+    Image,
+    ImageArray,
+    decode_image,
+    probe_image_size,
+    resize_image,
+    synthetic_page,
+)
 from .utils.logger_configure import configure_logging
+from .utils.metrics import (
+    BOXES,
+    MODEL_READY,
+    PAGES,
+    QUEUE_DEPTH,
+    STAGE_SECONDS,
+    Labels,
+)
 from .utils.minio import MinioDataLoader, NoSuchBucket
-from .utils.rendering import RenderImages
+from .utils.model_cache import ModelCache
+from .utils.rendering import RenderImages, detection_dpi, page_bytes
+from .utils.results import ResultSpool
+from .utils.scheduler import BatchScheduler
+from .utils.tiling import (
+    Tile,
+    merge_tile_detections,
+    needs_tiling,
+    split_into_tiles,
+)
+
+if TYPE_CHECKING:
+    from mmcv import Config
+
+    from .utils.workers import InferenceWorkers
 
 settings = Settings()
 
@@ -23,12 +76,77 @@ client = MinioDataLoader(
     endpoint=settings.minio_host,
     access_key=settings.minio_access_key,
     secret_key=settings.minio_secret_key,
+    pool_size=settings.minio_pool_size,
+    transfer_workers=settings.minio_transfer_workers,
+    metadata_ttl=settings.minio_metadata_ttl,
+)
+
+model_cache = ModelCache(
+    minio_client=client,
+    directory=Path(settings.model_cache_dir),
+    max_bytes=settings.model_cache_max_bytes,
+)
+
+detection_cache = DetectionCache(
+    max_size=settings.result_cache_size,
+    ttl=settings.result_cache_ttl,
+    minio_client=client,
+    bucket=settings.result_cache_bucket,
+    prefix=settings.result_cache_prefix,
+)
+
+verbose_executor = BoundedExecutor(
+    workers=settings.verbose_workers,
+    max_pending=settings.verbose_queue_size,
+    name="verbose",
 )
 
+T = TypeVar("T")
+
+
+class ModelIsUnloaded(Exception):
+    pass
+
+
+class BatchPage(NamedTuple):
+    """Page of a document or an image from a batch of predictions"""
+
+    item: int
+    bucket: str
+    img: str
+    page: Optional[int]
+    size: Optional[Size]
+    dpi: float
+    array: Optional[ImageArray]
+    verbose: bool
+    output_format: str
+
+
+def as_array(
+    content: Union[bytes, ImageArray], factor: float = 1.0
+) -> ImageArray:
+    if isinstance(content, bytes):
+        content = decode_image(content)
+    return resize_image(content, factor)
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split iterable into lists of the given size"""
+
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
 
 class InferenceService:
 
+    LOADING = "loading"
+    WARMING = "warming"
+    READY = "ready"
+
     models: Dict[str, "InferenceService"] = {}
+    loading: Dict[str, str] = {}
+    models_lock = threading.Lock()
 
     def __init__(
         self,
@@ -38,6 +156,7 @@ class InferenceService:
         config_bucket: str,
         config_file: str,
         device: str,
+        register: bool = True,
     ) -> None:
         if not client.bucket_exists(data_bucket) or not client.bucket_exists(
             config_bucket
@@ -50,29 +169,232 @@ class InferenceService:
         self.name = name
         self.ready: bool = False
         self.model: Any = None
-        self.config: Config
-        self.add_model(name, self)
+        self.state = self.LOADING
+        self.config: "Config"
+        self.scheduler: Optional[BatchScheduler] = None
+        self.workers: Optional["InferenceWorkers"] = None
+        self.checkpoint_etag = ""
+        self.backend = settings.inference_backend
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.retired = False
+        self.closed = False
+        if register:
+            self.add_model(name, self)
         self.data_bucket = data_bucket
         self.data_file = data_file
         self.config_bucket = config_bucket
         self.config_file = config_file
+        self.device = device
         self.load(device)
 
     @classmethod
     def add_model(cls, name: str, model: "InferenceService") -> None:
-        cls.models[name] = model
+        with cls.models_lock:
+            old_model = cls.models.get(name)
+            cls.models[name] = model
+        if old_model and old_model is not model:
+            old_model.retire()
+
+    @classmethod
+    def remove_model(cls, name: str) -> bool:
+        with cls.models_lock:
+            model = cls.models.pop(name, None)
+        if not model:
+            return False
+        model.retire()
+        return True
+
+    @classmethod
+    def load_in_background(
+        cls,
+        name: str,
+        data_bucket: str,
+        data_file: str,
+        config_bucket: str,
+        config_file: str,
+        device: str,
+    ) -> bool:
+        """Build new service in a thread and swap it in when it is ready.
+
+        Requests keep using the previous version of the model until then.
+        Returns False if the model with this name is already loading.
+        """
+
+        with cls.models_lock:
+            if name in cls.loading:
+                return False
+            cls.loading[name] = cls.LOADING
+
+        def build() -> None:
+            try:
+                model = cls(
+                    name,
+                    data_bucket,
+                    data_file,
+                    config_bucket,
+                    config_file,
+                    device,
+                    register=False,
+                )
+                if model.ready:
+                    cls.add_model(name, model)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("Loading of %s is failed: %s", name, err)
+                return
+            finally:
+                with cls.models_lock:
+                    cls.loading.pop(name, None)
+            if not model.ready:
+                logger.info("%s isn't ready, keep previous version", name)
+                return
+            logger.info(
+                "%s is swapped to checkpoint with etag %s",
+                name,
+                model.checkpoint_etag,
+            )
+
+        threading.Thread(
+            target=build, name=f"load-{name}", daemon=True
+        ).start()
+        return True
+
+    @staticmethod
+    def missing_files(
+        data_bucket: str, data_file: str, config_bucket: str, config_file: str
+    ) -> List[str]:
+        """Return paths of checkpoint and config which don't exist on minio"""
+
+        missing = []
+        for bucket, file in (
+            (data_bucket, data_file),
+            (config_bucket, config_file),
+        ):
+            try:
+                client.stat_object(bucket, file)
+            except S3Error:
+                missing.append(f"{bucket}/{file}")
+        return missing
+
+    @classmethod
+    def readiness(cls, name: str) -> Optional[str]:
+        """State of the model, None if it is neither served nor loading"""
+
+        with cls.models_lock:
+            model = cls.models.get(name)
+            if model and model.ready:
+                return cls.READY
+            return cls.loading.get(name) or (model.state if model else None)
+
+    def set_state(self, state: str) -> None:
+        """Change state, shown for the name until the model is swapped in"""
+
+        with self.models_lock:
+            self.state = state
+            if (
+                self.name in self.loading
+                and self.models.get(self.name) is not self
+            ):
+                self.loading[self.name] = state
+
+    @classmethod
+    @contextmanager
+    def acquire(cls, name: str) -> Iterator[Optional["InferenceService"]]:
+        """Current version of the model held for the whole request.
+
+        The request is counted under the registry lock, so a version
+        swapped in right after the lookup doesn't close the model under
+        the request. None is yielded for a not existing model.
+        """
+
+        with cls.models_lock:
+            model = cls.models.get(name)
+            if model:
+                model.begin_request()
+        if not model:
+            yield None
+            return
+        try:
+            yield model
+        finally:
+            model.end_request()
+
+    def begin_request(self) -> None:
+        with self.lock:
+            if self.closed:
+                raise ModelIsUnloaded(f"Model {self.name} is unloaded")
+            self.in_flight += 1
+
+    def end_request(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            close = self.retired and not self.in_flight
+        if close:
+            self.close()
+
+    @contextmanager
+    def track_request(self) -> Iterator[None]:
+        """Keep the model alive while the request uses it"""
+
+        self.begin_request()
+        try:
+            yield
+        finally:
+            self.end_request()
+
+    def retire(self) -> None:
+        """Close the model after the last in-flight request is finished"""
+
+        with self.lock:
+            self.retired = True
+            close = not self.in_flight
+        if close:
+            self.close()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.ready = False
+        logger.info("Release %s with etag %s", self.name, self.checkpoint_etag)
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+        if self.workers:
+            self.workers.stop()
+            self.workers = None
+        self.model = None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "model_name": self.name,
+            "is_ready": self.ready,
+            "version": self.checkpoint_etag,
+            "backend": self.backend,
+            "data_bucket": self.data_bucket,
+            "data_file": self.data_file,
+            "config_bucket": self.config_bucket,
+            "config_file": self.config_file,
+        }
 
     def load(self, device: str = settings.device) -> None:
-        model_path = Path(tempfile.mkdtemp()) / f"{self.name}.pth"
-        config_path = Path(tempfile.mkdtemp()) / f"{self.name}.py"
+        # pylint: disable=import-outside-toplevel
+        from mmcv import Config
+        from mmdet.apis import init_detector
+
+        from .utils.backends import optimize_model
+        from .utils.workers import InferenceWorkers
 
         if self.config_file.endswith(".py"):
             logger.info("Downloading config from %s", self.config_file)
-            if not client.download_file_from_minio(
-                self.config_bucket, self.config_file, config_path
-            ):
+            cached_config = model_cache.get(
+                self.config_bucket, self.config_file
+            )
+            if not cached_config:
                 logger.info("No such file %s", self.config_file)
                 return
+            config_path = cached_config.path
             self.config = Config.fromfile(config_path)
         else:
             logger.info(
@@ -83,11 +405,12 @@ class InferenceService:
             return
         if self.data_file.endswith(".pth"):
             logger.info("Downloading model from %s", self.data_file)
-            if not client.download_file_from_minio(
-                self.data_bucket, self.data_file, model_path
-            ):
+            cached_model = model_cache.get(self.data_bucket, self.data_file)
+            if not cached_model:
                 logger.info("No such file %s", self.data_file)
                 return
+            model_path = cached_model.path
+            self.checkpoint_etag = cached_model.etag
         else:
             logger.info(
                 "Wrong path to checkpoint: %s/%s",
@@ -101,10 +424,206 @@ class InferenceService:
             model_path,
         )
         self.model = init_detector(self.config, str(model_path), device)
+        self.backend = optimize_model(
+            self.model,
+            settings.inference_backend,
+            settings.quantize_dynamic,
+            model_path,
+        )
+        if settings.inference_workers and device == "cpu":
+            self.workers = InferenceWorkers(
+                self.model,
+                workers=settings.inference_workers,
+                threads=settings.inference_worker_threads,
+            )
+        if settings.scheduler_enabled:
+            self.scheduler = BatchScheduler(
+                detect=self.run_detector,
+                max_batch_size=settings.scheduler_max_batch_size,
+                max_wait=settings.scheduler_max_wait_ms / 1000,
+            )
+        if settings.warm_up:
+            self.set_state(self.WARMING)
+            self.warm_up()
+        self.state = self.READY
         self.ready = True
 
+    def warm_up(self) -> None:
+        """Run detector on synthetic pages before taking traffic.
+
+        The first forward passes allocate buffers and initialize kernels,
+        so it is paid here instead of by the first requests. Pages go
+        through the same path as real ones, with inference workers each
+        worker gets its own pages and warms up itself.
+        """
+
+        size = Size(width=612, height=792)
+        dpi = detection_dpi(
+            size,
+            settings.detection_dpi or settings.dpi,
+            settings.detection_max_side,
+        )
+        page = synthetic_page(
+            round(size.width * dpi / settings.inch_to_point),
+            round(size.height * dpi / settings.inch_to_point),
+        )
+        count = settings.batch_size
+        if self.workers:
+            count = max(count, len(self.workers.processes))
+        with STAGE_SECONDS.time(stage="warm_up"):
+            try:
+                self.detect([page] * count)
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("Warm-up of %s is failed: %s", self.name, err)
+                return
+        logger.info("%s is warmed up on %s pages", self.name, count)
+
+    def detect(self, imgs: Sequence[Image]) -> List[Any]:
+        """Run detector, images bigger than tile_size are split into tiles"""
+
+        if not any(needs_tiling(img, settings.tile_size) for img in imgs):
+            return self.detect_batch(imgs)
+        return self.detect_tiled(imgs)
+
+    def detect_tiled(self, imgs: Sequence[Image]) -> List[Any]:
+        """Detect tiles of big images and merge them into one detection.
+
+        Tiles and small images are sent to the detector in batches of
+        batch_size, so memory of one forward pass doesn't depend on the
+        size of images.
+        """
+
+        inputs: List[Image] = []
+        parts: List[Tuple[int, int, List[Tile]]] = []
+        sizes: List[Tuple[int, int]] = []
+        for img in imgs:
+            tiles: Sequence[Image] = [img]
+            boxes: List[Tile] = []
+            if isinstance(img, np.ndarray):
+                sizes.append((img.shape[1], img.shape[0]))
+                if needs_tiling(img, settings.tile_size):
+                    tiles, boxes = split_into_tiles(
+                        img, settings.tile_size, settings.tile_overlap
+                    )
+            else:
+                sizes.append((0, 0))
+            parts.append((len(inputs), len(tiles), boxes))
+            inputs.extend(tiles)
+        logger.info("Detect %s images in %s tiles", len(imgs), len(inputs))
+        detections: List[Any] = []
+        for batch in batched(inputs, settings.batch_size):
+            detections.extend(self.detect_batch(batch))
+        results = []
+        for (start, count, boxes), size in zip(parts, sizes):
+            if not boxes:
+                results.append(detections[start])
+                continue
+            results.append(
+                merge_tile_detections(
+                    detections[start : start + count],
+                    boxes,
+                    size,
+                    settings.tile_nms_iou,
+                )
+            )
+        return results
+
+    def detect_batch(self, imgs: Sequence[Image]) -> List[Any]:
+        """Run detector, through the batch scheduler if it is enabled"""
+
+        if self.scheduler:
+            return self.scheduler.detect(imgs)
+        return self.run_detector(imgs)
+
+    def run_detector(self, imgs: Sequence[Image]) -> List[Any]:
+        """Forward pass in worker processes or in this process"""
+
+        # pylint: disable=import-outside-toplevel
+        from .utils.detection import inference_detector_batch
+
+        if self.workers:
+            return self.workers.detect(imgs)
+        return inference_detector_batch(self.model, imgs)
+
+    def detect_with_cache(
+        self,
+        contents: Sequence[Union[bytes, ImageArray]],
+        factors: Optional[Sequence[float]] = None,
+        errors: Optional[Dict[int, Exception]] = None,
+    ) -> Tuple[List[Any], List[Optional[ImageArray]]]:
+        """Run detector only for pages which aren't in the result cache.
+
+        Contents are encoded images or decoded arrays of pages, they are
+        resized by factors before detection. Decoded images are returned
+        along with detections, cached pages aren't decoded at all, so their
+        images are None. If errors is given, pages which can't be decoded
+        are put there by index and aren't detected, otherwise the error is
+        raised.
+        """
+
+        factors = factors or [1.0] * len(contents)
+        keys: List[Optional[str]] = [None] * len(contents)
+        if detection_cache.enabled:
+            keys = [
+                detection_cache.key(
+                    content,
+                    settings.dpi * factor,
+                    settings.default_thresholds,
+                    f"{self.checkpoint_etag}/{self.backend}",
+                )
+                for content, factor in zip(contents, factors)
+            ]
+        detections: List[Any] = [
+            detection_cache.get(key) if key else None for key in keys
+        ]
+        images: List[Optional[ImageArray]] = [None] * len(contents)
+        missing, inputs = [], []
+        for i, detection in enumerate(detections):
+            if detection is not None:
+                continue
+            try:
+                image = as_array(contents[i], factors[i])
+            except ValueError as err:
+                if errors is None:
+                    raise
+                errors[i] = err
+                continue
+            images[i] = image
+            missing.append(i)
+            inputs.append(image)
+        for i, detection in zip(missing, self.detect(inputs)):
+            detections[i] = detection
+            key = keys[i]
+            if key:
+                detection_cache.set(
+                    key, detection, settings.default_thresholds
+                )
+        return detections, images
+
     def predict(self, request: Predict) -> Optional[Dict[str, Dict[str, Any]]]:
+        with self.track_request():
+            if not self.prepare_buckets(request):
+                return None
+
+            if request.file.endswith(".pdf"):
+                return self.predict_for_pdf(request=request)
+            res = self.predict_for_image(request=request)
+        return prepare_response(res)
+
+    def predict_stream(
+        self, request: Predict
+    ) -> Optional[Iterator[Dict[str, Any]]]:
+        """Predict pages one by one, each result is yielded when it's done.
+
+        The full json is put to output_path after the last page as usual.
+        """
 
+        if not self.prepare_buckets(request):
+            return None
+        return self.iter_predictions(request)
+
+    @staticmethod
+    def prepare_buckets(request: Predict) -> bool:
         request.output_bucket = (
             request.output_bucket if request.output_bucket else request.bucket
         )
@@ -112,60 +631,472 @@ class InferenceService:
             logger.info(
                 "Wrong way to images: %s does not exist", request.bucket
             )
-            return None
+            return False
         if not client.bucket_exists(request.output_bucket):
             client.make_bucket(request.output_bucket)
+        return True
 
-        if request.file.endswith(".pdf"):
-            res = self.predict_for_pdf(request=request)
-        else:
-            res = self.predict_for_image(request=request)
-        return prepare_response(res)
+    def iter_predictions(self, request: Predict) -> Iterator[Dict[str, Any]]:
+        """Predict with the version of the model served when streaming starts.
 
-    def predict_for_pdf(self, request: Predict) -> List[Any]:
-        inference_results: List[Any] = []
-        render_instance = RenderImages(
+        The stream starts after the route has returned, a newer version may
+        be swapped in by then and this one may be already closed.
+        """
+
+        with self.acquire(self.name) as current:
+            model = current or self
+            with model.track_request(), ResultSpool() as spool:
+                if request.file.endswith(".pdf"):
+                    predictions = model.iter_predict_for_pdf(request=request)
+                else:
+                    predictions = iter(
+                        model.predict_for_image(request, save=False)
+                    )
+                for prediction in predictions:
+                    if settings.save_partial_results:
+                        self.save_page_result_on_minio(request, prediction)
+                    spool.add(prediction)
+                    yield prediction
+                self.save_spool_on_minio(request, spool)
+
+    def predict_for_pdf(self, request: Predict) -> Dict[str, Dict[str, Any]]:
+        """Predict pages window by window and return the response table"""
+
+        with ResultSpool() as spool:
+            for prediction in self.iter_predict_for_pdf(request):
+                spool.add(prediction)
+            self.save_spool_on_minio(request, spool)
+        return spool.response
+
+    def iter_predict_for_pdf(
+        self, request: Predict
+    ) -> Iterator[Dict[str, Any]]:
+        verbose = request.args.verbose if request.args else False
+        verbose_pages = (
+            self.select_verbose_pages(request.pages)  # type: ignore
+            if verbose
+            else set()
+        )
+        output_format = (
+            request.args.output_format if request.args else OBJECTS_FORMAT
+        )
+        with RenderImages(
             dpi=settings.dpi,
             image_format=settings.image_format,
             minio_client=client,
+            workers=settings.render_workers,
+        ) as render_instance, admission.lease() as lease:
+            sizes: Dict[int, Size] = render_instance.get_size_pages(
+                file=request.file, bucket=request.bucket, pages=request.pages  # type: ignore
+            )
+            resolutions = self.page_resolutions(sizes)
+            pages = self.iter_rendered_pages(
+                render_instance, request, sizes, resolutions, lease
+            )
+            for batch in batched(pages, settings.batch_size):
+                predictions = self.get_boxes_from_images(
+                    bucket=request.bucket,
+                    imgs=[img for _, img, _ in batch],
+                    pages=[page for page, _, _ in batch],
+                    sizes=[sizes[page] for page, _, _ in batch],
+                    verbose_pages=verbose_pages,
+                    arrays=[
+                        array for _, _, array in batch if array is not None
+                    ],
+                    output_format=output_format,
+                    resolutions=[resolutions[page] for page, _, _ in batch],
+                )
+                lease.release(
+                    len(batch),
+                    sum(
+                        self.admitted_bytes(sizes[page], resolutions[page])
+                        for page, _, _ in batch
+                    ),
+                )
+                yield from predictions
+
+    @staticmethod
+    def page_resolutions(sizes: Dict[int, Size]) -> Dict[int, float]:
+        return {
+            page: detection_dpi(
+                size,
+                settings.detection_dpi or settings.dpi,
+                settings.detection_max_side,
+            )
+            for page, size in sizes.items()
+        }
+
+    @staticmethod
+    def admitted_bytes(size: Size, resolution: float) -> int:
+        """Budget of a page, it is rendered in dpi or in a higher one"""
+
+        return page_bytes(size, max(settings.dpi, resolution))
+
+    def iter_rendered_pages(
+        self,
+        render_instance: RenderImages,
+        request: Predict,
+        sizes: Dict[int, Size],
+        resolutions: Dict[int, float],
+        lease: AdmissionLease,
+    ) -> Iterator[Tuple[int, str, Optional[ImageArray]]]:
+        """Render pages of the document window by window.
+
+        A window has pages_in_flight pages rounded up to whole batches. It
+        is admitted to the global memory budget with the lease before
+        rendering. The caller releases pages from the lease after they are
+        detected, pages which aren't yielded are released here.
+        """
+
+        pages: List[int] = request.pages  # type: ignore
+        missing = [page for page in pages if page not in sizes]
+        if missing:
+            raise ValueError(f"Wrong page numbers: {missing}")
+        window = settings.batch_size * math.ceil(
+            max(1, settings.pages_in_flight) / settings.batch_size
         )
-        sizes: Dict[int, Size] = render_instance.get_size_pages(
-            file=request.file, bucket=request.bucket, pages=request.pages  # type: ignore
-        )
-        images = render_instance.render(
-            bucket=request.bucket,
-            file=request.file,
-            pages=request.pages,  # type: ignore
+        for start in range(0, len(pages), window):
+            window_pages = pages[start : start + window]
+            costs = [
+                self.admitted_bytes(sizes[page], resolutions[page])
+                for page in window_pages
+            ]
+            lease.acquire(len(costs), sum(costs))
+            done = 0
+            try:
+                rendered: Iterable[Tuple[str, Optional[ImageArray]]]
+                if settings.in_memory_pipeline:
+                    rendered = render_instance.render_to_arrays(
+                        bucket=request.bucket,
+                        file=request.file,
+                        pages=window_pages,
+                        cache=settings.cache_rendered_images,
+                        resolutions=resolutions,
+                    )
+                else:
+                    images = render_instance.render(
+                        bucket=request.bucket,
+                        file=request.file,
+                        pages=window_pages,
+                    )
+                    rendered = ((img, None) for img in images)
+                for page, (img, array) in zip(window_pages, rendered):
+                    done += 1
+                    yield page, img, array
+            finally:
+                lease.release(len(costs) - done, sum(costs[done:]))
+
+    def predict_batch(self, requests: List[Predict]) -> List[Dict[str, Any]]:
+        """Predict many documents and images as one workload.
+
+        Pages of all items are rendered one document after another and go
+        to the detector in shared batches, so small documents fill batches
+        together. Json of every item is put to its own output_path. A failed
+        item doesn't stop others, its status is returned with the reason.
+        A batch may hold pages of two windows, so pages are released from
+        the memory budget when their batch is done, not by windows.
+        """
+
+        results: List[List[Dict[str, Any]]] = [[] for _ in requests]
+        failed: Dict[int, str] = {}
+        with self.track_request(), admission.lease() as lease:
+            for index, request in enumerate(requests):
+                if not self.prepare_buckets(request):
+                    failed[index] = f"Not existing bucket {request.bucket}"
+            pages = self.iter_batch_pages(requests, failed, lease)
+            for batch in batched(pages, settings.batch_size):
+                live = [page for page in batch if page.item not in failed]
+                predictions: List[Tuple[BatchPage, Dict[str, Any]]] = []
+                try:
+                    if live:
+                        predictions = self.predict_batch_pages(live, failed)
+                except Exception as err:  # pylint: disable=broad-except
+                    logger.info("Batch of pages is failed: %s", err)
+                    for page in live:
+                        failed[page.item] = f"{err}"
+                lease.release(
+                    sum(page.size is not None for page in batch),
+                    sum(
+                        self.admitted_bytes(page.size, page.dpi)
+                        for page in batch
+                        if page.size is not None
+                    ),
+                )
+                for page, prediction in predictions:
+                    results[page.item].append(prediction)
+
+        def save(index: int) -> None:
+            try:
+                self.save_results_on_minio(requests[index], results[index])
+            except Exception as err:  # pylint: disable=broad-except
+                failed[index] = f"{err}"
+
+        list(
+            client.transfer_executor.map(
+                save,
+                [
+                    index
+                    for index in range(len(requests))
+                    if index not in failed
+                ],
+            )
         )
-        for img, page in zip(images, sizes):
-            inference_results.append(
-                self.get_boxes_from_image(
-                    bucket=request.bucket,
-                    img=img,
-                    page=page,
-                    size=sizes[page],
-                    verbose=request.args.verbose if request.args else False,
+        return [
+            {
+                "file": request.file,
+                "output_path": request.output_path,
+                "status": "failed" if index in failed else "done",
+                "detail": failed.get(index),
+            }
+            for index, request in enumerate(requests)
+        ]
+
+    def iter_batch_pages(
+        self,
+        requests: List[Predict],
+        failed: Dict[int, str],
+        lease: AdmissionLease,
+    ) -> Iterator[BatchPage]:
+        """Render documents of the batch one by one and yield their pages"""
+
+        for index, request in enumerate(requests):
+            if index in failed:
+                continue
+            verbose = request.args.verbose if request.args else False
+            output_format = (
+                request.args.output_format if request.args else OBJECTS_FORMAT
+            )
+            if not request.file.endswith(".pdf"):
+                yield BatchPage(
+                    index,
+                    request.bucket,
+                    request.file,
+                    None,
+                    None,
+                    settings.dpi,
+                    None,
+                    verbose,
+                    output_format,
+                )
+                continue
+            try:
+                yield from self.iter_document_pages(
+                    index, request, verbose, output_format, lease
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("Rendering of %s is failed: %s", request.file, err)
+                failed[index] = f"{err}"
+
+    def iter_document_pages(
+        self,
+        index: int,
+        request: Predict,
+        verbose: bool,
+        output_format: str,
+        lease: AdmissionLease,
+    ) -> Iterator[BatchPage]:
+        pages: List[int] = request.pages  # type: ignore
+        verbose_pages = self.select_verbose_pages(pages) if verbose else set()
+        with RenderImages(
+            dpi=settings.dpi,
+            image_format=settings.image_format,
+            minio_client=client,
+            workers=settings.render_workers,
+        ) as render_instance:
+            sizes = render_instance.get_size_pages(
+                file=request.file, bucket=request.bucket, pages=pages
+            )
+            resolutions = self.page_resolutions(sizes)
+            for page, img, array in self.iter_rendered_pages(
+                render_instance, request, sizes, resolutions, lease
+            ):
+                yield BatchPage(
+                    index,
+                    request.bucket,
+                    img,
+                    page,
+                    sizes[page],
+                    resolutions[page],
+                    array,
+                    page in verbose_pages,
+                    output_format,
                 )
+
+    def predict_batch_pages(
+        self, batch: List[BatchPage], failed: Dict[int, str]
+    ) -> List[Tuple[BatchPage, Dict[str, Any]]]:
+        """Detect and extract boxes from pages of different items at once.
+
+        A page which can't be downloaded or decoded fails only its own item,
+        the reason is put to failed and other pages go to the detector.
+        """
+
+        def download(page: BatchPage) -> Union[bytes, Exception]:
+            try:
+                return client.get_bytes(page.bucket, page.img)
+            except Exception as err:  # pylint: disable=broad-except
+                return err
+
+        def fail(page: BatchPage, err: Exception) -> None:
+            logger.info(
+                "Page %s of %s is failed: %s", page.page, page.img, err
+            )
+            failed[page.item] = f"{err}"
+
+        to_download = [page for page in batch if page.array is None]
+        downloaded = dict(
+            zip(
+                (id(page) for page in to_download),
+                client.transfer_executor.map(download, to_download),
             )
-        self.save_results_on_minio(
-            request=request, inference_results=inference_results
         )
-        return inference_results
+        pages: List[BatchPage] = []
+        contents: List[Union[bytes, ImageArray]] = []
+        factors: List[float] = []
+        probed_sizes: List[Optional[Tuple[int, int]]] = []
+        for page in batch:
+            content: Union[bytes, ImageArray]
+            probed_size = None
+            if page.array is not None:
+                content, factor = page.array, 1.0
+            else:
+                data = downloaded[id(page)]
+                if isinstance(data, Exception):
+                    fail(page, data)
+                    continue
+                content = data
+                if page.page is None:
+                    probed_size = probe_image_size(content)
+                    factor = self.image_factor(probed_size)
+                else:
+                    factor = page.dpi / settings.dpi
+            pages.append(page)
+            contents.append(content)
+            factors.append(factor)
+            probed_sizes.append(probed_size)
+        errors: Dict[int, Exception] = {}
+        detections, images = self.detect_with_cache(contents, factors, errors)
 
-    def predict_for_image(self, request: Predict) -> List[Any]:
+        predictions = []
+        for i, page in enumerate(pages):
+            if i in errors:
+                fail(page, errors[i])
+                continue
+            content, image, factor = contents[i], images[i], factors[i]
+            detection, probed_size = detections[i], probed_sizes[i]
+            if page.verbose:
+                self.submit_verbose_image(
+                    page.bucket,
+                    page.img,
+                    image if image is not None else as_array(content, factor),
+                    detection,
+                    document=page.page is not None,
+                )
+            if page.page is not None:
+                prediction = self.extract_page(
+                    detection,
+                    page.size,  # type: ignore
+                    page.output_format,
+                    page_number=page.page,
+                    document=True,
+                    scale=settings.dpi / page.dpi,
+                )
+            else:
+                if probed_size:
+                    width, height = probed_size
+                else:
+                    height, width, _channels = as_array(content).shape
+                prediction = self.extract_page(
+                    detection,
+                    Size(width=width, height=height),
+                    page.output_format,
+                    scale=1 / factor,
+                )
+            predictions.append((page, prediction))
+        return predictions
+
+    def predict_for_image(
+        self, request: Predict, save: bool = True
+    ) -> List[Any]:
         inference_results: List[Any] = []
+        verbose = request.args.verbose if request.args else False
+        output_format = (
+            request.args.output_format if request.args else OBJECTS_FORMAT
+        )
         inference_results.append(
             self.get_boxes_from_image(
                 bucket=request.bucket,
                 img=request.file,
-                verbose=request.args.verbose if request.args else False,
+                verbose=verbose,
+                output_format=output_format,
             )
         )
-        self.save_results_on_minio(
-            request=request, inference_results=inference_results
-        )
+        if save:
+            self.save_results_on_minio(
+                request=request, inference_results=inference_results
+            )
         return inference_results
 
+    def get_boxes_from_images(
+        self,
+        bucket: str,
+        imgs: List[str],
+        pages: List[int],
+        sizes: List[Size],
+        verbose_pages: Collection[int] = (),
+        arrays: Optional[List[ImageArray]] = None,
+        output_format: str = OBJECTS_FORMAT,
+        resolutions: Optional[List[float]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Extract boxes from rendered pages of a document in one batch.
+
+        If arrays are given, they are used as already decoded page images
+        in detection resolutions instead of downloading imgs from minio.
+        Images from minio are in settings.dpi, they are downscaled to
+        resolutions, and bboxes are mapped back to points in both cases.
+        """
+
+        logger.info("Extracting boxes from: %s", ", ".join(imgs))
+        resolutions = resolutions or [settings.dpi] * len(imgs)
+        contents: Sequence[Union[bytes, ImageArray]]
+        if arrays:
+            contents = arrays
+            factors = [1.0] * len(imgs)
+        else:
+            contents = client.get_many_bytes(bucket, imgs)
+            factors = [dpi / settings.dpi for dpi in resolutions]
+        detections, images = self.detect_with_cache(contents, factors)
+        predictions = []
+        for img, content, image, detection, page, size, dpi, factor in zip(
+            imgs,
+            contents,
+            images,
+            detections,
+            pages,
+            sizes,
+            resolutions,
+            factors,
+        ):
+            if page in verbose_pages:
+                self.submit_verbose_image(
+                    bucket,
+                    img,
+                    image if image is not None else as_array(content, factor),
+                    detection,
+                    document=True,
+                )
+            predictions.append(
+                self.extract_page(
+                    detection,
+                    size,
+                    output_format,
+                    page_number=page,
+                    document=True,
+                    scale=settings.dpi / dpi,
+                )
+            )
+        return predictions
+
     def get_boxes_from_image(
         self,
         bucket: str,
@@ -173,72 +1104,188 @@ class InferenceService:
         page: Optional[int] = 1,
         size: Optional[Size] = None,
         verbose: bool = False,
+        output_format: str = OBJECTS_FORMAT,
     ) -> Dict[str, Any]:
         logger.info("Extracting boxes from: %s", img)
-        local_img = str(
-            Path(tempfile.mkdtemp())
-            / f"{uuid.uuid4()}.{settings.image_format}"
-        )
-        client.fget_object(bucket, img, local_img)
-        detection = inference_detector(self.model, local_img)
-        logger.info(f"verbose {verbose}")
+        data = client.get_bytes(bucket, img)
+        probed_size = None if size else probe_image_size(data)
+        factor = self.image_factor(probed_size)
+        [detection], [image] = self.detect_with_cache([data], [factor])
+        logger.info("verbose %s", verbose)
         if verbose:
-            img_verbose = self.model.show_result(
-                local_img,
-                detection,
-                score_thr=settings.default_thresholds,
-                show=False,
-            )
-            local_img_verbose = str(
-                Path(tempfile.mkdtemp())
-                / f"{uuid.uuid4()}.{settings.image_format}"
-            )
-            cv2.imwrite(local_img_verbose, img_verbose)
-            if size:
-                img_path = img.replace(
-                    f"images_{settings.dpi}", "verbose_latex"
-                )
-            else:
-                img_path = str(
-                    Path(img).parent
-                    / "verbose_latex"
-                    / f"1.{settings.image_format}"
-                )
-            logger.info("Save image with bboxes to %s", img_path)
-            client.fput_object(
-                bucket,
-                img_path,
-                local_img_verbose,
+            if image is None:
+                image = as_array(data, factor)
+            self.submit_verbose_image(
+                bucket, img, image, detection, document=bool(size)
             )
         if not size:
-            image = cv2.imread(local_img)
-            height, width, _channels = image.shape
+            if probed_size:
+                width, height = probed_size
+            else:
+                if image is None:
+                    image = decode_image(data)
+                height, width, _channels = image.shape
             size = Size(width=width, height=height)
-            prediction = extract_boxes_from_result(
-                result=detection,
-                classes=self.model.CLASSES,
-                score_thr=settings.default_thresholds,
-                size=size.dict(),
-                document=False,
+            return self.extract_page(
+                detection, size, output_format, scale=1 / factor
             )
-        else:
+        return self.extract_page(
+            detection, size, output_format, page_number=page, document=True
+        )
+
+    @staticmethod
+    def image_factor(size: Optional[Tuple[int, int]]) -> float:
+        """Downscale factor of an image for detection_max_side"""
+
+        if size and settings.detection_max_side:
+            return min(1.0, settings.detection_max_side / max(size))
+        return 1.0
+
+    def extract_page(
+        self,
+        detection: Any,
+        size: Size,
+        output_format: str,
+        page_number: Optional[int] = 1,
+        document: bool = False,
+        scale: float = 1.0,
+    ) -> Dict[str, Any]:
+        with STAGE_SECONDS.time(stage="extraction"):
             prediction = extract_boxes_from_result(
                 result=detection,
                 classes=self.model.CLASSES,
-                page_number=page,
+                page_number=page_number,
                 score_thr=settings.default_thresholds,
                 size=size.dict(),
-                document=True,
+                document=document,
+                output_format=output_format,
+                scale=scale,
             )
+        PAGES.inc()
+        boxes = prediction.get("objs", prediction.get("ids", ()))
+        BOXES.inc(len(boxes))
         return prediction
 
+    @staticmethod
+    def select_verbose_pages(pages: List[int]) -> Set[int]:
+        """Sample pages for verbose images and cap their number"""
+
+        sampled = pages[:: settings.verbose_page_step]
+        if settings.verbose_max_pages:
+            sampled = sampled[: settings.verbose_max_pages]
+        return set(sampled)
+
+    def submit_verbose_image(
+        self,
+        bucket: str,
+        img: str,
+        image: Image,
+        detection: Any,
+        document: bool,
+    ) -> None:
+        """Draw and upload image with bboxes after the response is sent"""
+
+        verbose_executor.submit(
+            self.save_verbose_image,
+            self.model,
+            bucket,
+            img,
+            image,
+            detection,
+            document,
+        )
+
+    @staticmethod
+    def save_verbose_image(
+        model: Any,
+        bucket: str,
+        img: str,
+        image: Image,
+        detection: Any,
+        document: bool,
+    ) -> None:
+        # pylint: disable=import-outside-toplevel
+        from cv2 import cv2
+
+        img_verbose = model.show_result(
+            image,
+            detection,
+            score_thr=settings.default_thresholds,
+            show=False,
+        )
+        _, encoded = cv2.imencode(f".{settings.image_format}", img_verbose)
+        if document:
+            img_path = img.replace(f"images_{settings.dpi}", "verbose_latex")
+        else:
+            img_path = str(
+                Path(img).parent
+                / "verbose_latex"
+                / f"1.{settings.image_format}"
+            )
+        logger.info("Save image with bboxes to %s", img_path)
+        client.put_bytes(
+            bucket,
+            img_path,
+            encoded.tobytes(),
+            f"image/{settings.image_format}",
+        )
+
     @staticmethod
     def save_results_on_minio(
         request: Predict, inference_results: List[Any]
     ) -> None:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            file_path = Path(temp_dir) / Path(f"{uuid.uuid4()}.json")
-            file_path.write_text(json.dumps({"pages": inference_results}))
+        with STAGE_SECONDS.time(stage="result_upload"):
+            client.put_bytes(
+                request.output_bucket,  # type: ignore
+                request.output_path,
+                json.dumps({"pages": inference_results}).encode(),
+                "application/json",
+            )
+
+    @staticmethod
+    def save_spool_on_minio(request: Predict, spool: ResultSpool) -> None:
+        with STAGE_SECONDS.time(stage="result_upload"):
             client.fput_object(
-                request.output_bucket, request.output_path, file_path
+                request.output_bucket,
+                request.output_path,
+                str(spool.finish()),
+                content_type="application/json",
             )
+
+    @staticmethod
+    def save_page_result_on_minio(
+        request: Predict, prediction: Dict[str, Any]
+    ) -> None:
+        """Put partial json with one page next to the output_path"""
+
+        page_path = (
+            f"{request.output_path[:-len('.json')]}/pages/"
+            f"{prediction['page_num']}.json"
+        )
+        client.put_bytes(
+            request.output_bucket,  # type: ignore
+            page_path,
+            json.dumps(prediction).encode(),
+            "application/json",
+        )
+
+
+def models_readiness() -> Dict[Labels, float]:
+    return {
+        (name,): float(model.ready)
+        for name, model in list(InferenceService.models.items())
+    }
+
+
+def queue_depth() -> Dict[Labels, float]:
+    models = list(InferenceService.models.values())
+    depth = sum(model.scheduler.size() for model in models if model.scheduler)
+    pending = sum(model.workers.pending() for model in models if model.workers)
+    return {
+        ("scheduler",): float(depth),
+        ("inference_workers",): float(pending),
+    }
+
+
+MODEL_READY.set_function(models_readiness)
+QUEUE_DEPTH.set_function(queue_depth)
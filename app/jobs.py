@@ -0,0 +1,144 @@
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .config import Settings
+from .inference import InferenceService
+from .schemas import Predict
+from .utils.logger_configure import configure_logging
+from .utils.metrics import ERRORS, QUEUE_DEPTH
+
+settings = Settings()
+
+logger = configure_logging(__name__)
+
+
+class JobQueueIsFull(Exception):
+    pass
+
+
+class Job:
+    """Used for tracking prediction submitted to the job queue"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, model_name: str, request: Predict) -> None:
+        self.id = str(uuid.uuid4())
+        self.model_name = model_name
+        self.request = request
+        self.status = self.QUEUED
+        self.result: Optional[Dict[str, Dict[str, Any]]] = None
+        self.detail: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "model_name": self.model_name,
+            "status": self.status,
+            "output_bucket": self.request.output_bucket or self.request.bucket,
+            "output_path": self.request.output_path,
+            "detail": self.detail,
+        }
+
+
+class JobQueue:
+    """Bounded in-process queue of predictions run by inference workers"""
+
+    def __init__(self, workers: int, max_size: int, history_size: int) -> None:
+        self.workers = workers
+        self.history_size = history_size
+        self.queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_size)
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start inference workers if they aren't running yet"""
+
+        with self.lock:
+            if self.threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self.run_worker,
+                    name=f"inference-worker-{number}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, model_name: str, request: Predict) -> Job:
+        """Put prediction to the queue without waiting for a free slot.
+
+        The model is looked up when the job is started, so queued jobs use
+        the latest loaded version of it.
+        """
+
+        self.start()
+        job = Job(model_name, request)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            logger.info("Job queue is full, reject job for %s", request.file)
+            raise JobQueueIsFull
+        with self.lock:
+            self.jobs[job.id] = job
+            self.forget_finished_jobs()
+        logger.info("Job %s is queued for %s", job.id, request.file)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def size(self) -> int:
+        return self.queue.qsize()
+
+    def forget_finished_jobs(self) -> None:
+        """Keep only last history_size jobs, queued ones are never dropped"""
+
+        excess = len(self.jobs) - self.history_size
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].status in (Job.DONE, Job.FAILED):
+                del self.jobs[job_id]
+                excess -= 1
+
+    def run_worker(self) -> None:
+        while True:
+            job = self.queue.get()
+            job.status = Job.RUNNING
+            logger.info("Job %s is started", job.id)
+            try:
+                with InferenceService.acquire(job.model_name) as model:
+                    if not model or not model.ready:
+                        raise ValueError(f"Model {job.model_name} isn't ready")
+                    job.result = model.predict(job.request)
+                if job.result is None:
+                    job.detail = f"Not existing bucket {job.request.bucket}"
+                    job.status = Job.FAILED
+                    ERRORS.inc(source="jobs")
+                else:
+                    job.status = Job.DONE
+            except Exception as err:  # pylint: disable=broad-except
+                logger.info("Job %s is failed: %s", job.id, err)
+                job.detail = f"{err}"
+                job.status = Job.FAILED
+                ERRORS.inc(source="jobs")
+            finally:
+                self.queue.task_done()
+
+
+job_queue = JobQueue(
+    workers=settings.job_workers,
+    max_size=settings.job_queue_size,
+    history_size=settings.job_history_size,
+)
+
+QUEUE_DEPTH.set_function(lambda: {("jobs",): float(job_queue.size())})
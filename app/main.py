@@ -11,9 +11,13 @@ app.include_router(router)
 settings = Settings()
 
 
-if __name__ == "__main__":
-    settings = Settings()
-    InferenceService(
+@app.on_event("startup")
+def load_model() -> None:
+    """Load the model in background, so the server answers probes at once"""
+
+    if not settings.load_on_startup:
+        return
+    InferenceService.load_in_background(
         settings.model_name,
         settings.data_bucket,
         settings.data_file,
@@ -21,4 +25,7 @@ if __name__ == "__main__":
         settings.config_file,
         settings.device,
     )
+
+
+if __name__ == "__main__":
     uvicorn.run(app, host=settings.host, port=settings.port)
@@ -1,15 +1,37 @@
-from typing import Any, Dict
+import json
+from typing import Any, Dict, Iterator, List
 
 from fastapi import APIRouter, HTTPException, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
+from .config import Settings
 from .inference import InferenceService
+from .jobs import Job, JobQueueIsFull, job_queue
 from .schemas import (
+    LoadModel,
     Predict,
+    PredictBatch,
+    ResponseBatch,
+    ResponseIsReady,
+    ResponseJob,
+    ResponseJobQueueIsFull,
+    ResponseJobStatus,
+    ResponseModel,
     ResponsePredict,
     ResponsePredictModelIsNotReady,
+    ResponseScratchUsage,
+    ResponseUpload,
+    WrongResponseIsReady,
+    WrongResponseJob,
     WrongResponsePredict,
+    WrongResponseUpload,
 )
+from .utils.admission import AdmissionRejected
 from .utils.logger_configure import configure_logging
+from .utils.metrics import ERRORS, REGISTRY
+from .utils.scratch import scratch_space
+
+settings = Settings()
 
 logger = configure_logging(__name__)
 
@@ -31,21 +53,373 @@ router = APIRouter()
             "model": ResponsePredictModelIsNotReady,
             "description": "The model is not ready",
         },
+        429: {
+            "model": WrongResponsePredict,
+            "description": "Memory budget for pages in flight is exhausted",
+        },
     },
 )
 def predict(
     model_name: str, request: Predict, response: Response
 ) -> Dict[str, Any]:
+    with InferenceService.acquire(model_name) as model:
+        if not model:
+            logger.info("Predict get not existing model_name %s", model_name)
+            raise HTTPException(status_code=404, detail="Not existing model")
+        if not model.ready:
+            logger.info("%s isn't ready", model_name)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"status": "Model isn't ready"}
+        try:
+            result = model.predict(request)
+        except AdmissionRejected as err:
+            raise HTTPException(status_code=429, detail=f"{err}")
+        except Exception as err:
+            ERRORS.inc(source="predict")
+            raise HTTPException(status_code=404, detail=f"{err}")
+        return result  # type: ignore
+
+
+@router.post(
+    "/{model_name}:stream",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}},
+            "description": "Prediction for every page as a json line",
+        },
+        404: {
+            "model": WrongResponsePredict,
+            "description": "File doesnt exist or wrong page number in request",
+        },
+        202: {
+            "model": ResponsePredictModelIsNotReady,
+            "description": "The model is not ready",
+        },
+    },
+)
+def predict_stream(model_name: str, request: Predict) -> Response:
+    with InferenceService.acquire(model_name) as model:
+        if not model:
+            logger.info("Predict get not existing model_name %s", model_name)
+            raise HTTPException(status_code=404, detail="Not existing model")
+        if not model.ready:
+            logger.info("%s isn't ready", model_name)
+            return Response(
+                content=json.dumps({"status": "Model isn't ready"}),
+                status_code=status.HTTP_202_ACCEPTED,
+                media_type="application/json",
+            )
+        predictions = model.predict_stream(request)
+        if predictions is None:
+            raise HTTPException(status_code=404, detail="Not existing bucket")
+
+    def to_json_lines(pages: Iterator[Dict[str, Any]]) -> Iterator[str]:
+        try:
+            for page in pages:
+                yield json.dumps(page) + "\n"
+        except Exception as err:  # pylint: disable=broad-except
+            logger.info("Streaming of %s is failed: %s", request.file, err)
+            ERRORS.inc(source="stream")
+            yield json.dumps({"detail": f"{err}"}) + "\n"
+
+    return StreamingResponse(
+        to_json_lines(predictions), media_type="application/x-ndjson"
+    )
+
+
+@router.post(
+    "/{model_name}:batch",
+    responses={
+        200: {
+            "model": ResponseBatch,
+            "description": "The inference is done, status of every item",
+        },
+        404: {
+            "model": WrongResponsePredict,
+            "description": "Model doesnt exist",
+        },
+        202: {
+            "model": ResponsePredictModelIsNotReady,
+            "description": "The model is not ready",
+        },
+    },
+)
+def predict_batch(
+    model_name: str, request: PredictBatch, response: Response
+) -> Dict[str, Any]:
+    with InferenceService.acquire(model_name) as model:
+        if not model:
+            logger.info("Batch get not existing model_name %s", model_name)
+            raise HTTPException(status_code=404, detail="Not existing model")
+        if not model.ready:
+            logger.info("%s isn't ready", model_name)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"status": "Model isn't ready"}
+        try:
+            items = model.predict_batch(request.items)
+        except Exception as err:
+            ERRORS.inc(source="batch")
+            raise HTTPException(status_code=404, detail=f"{err}")
+        failed = sum(item["status"] == "failed" for item in items)
+        if failed:
+            ERRORS.inc(failed, source="batch")
+        return {"items": items}
+
+
+@router.post(
+    "/{model_name}:submit",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {
+            "model": ResponseJob,
+            "description": "The job is queued or the model is not ready",
+        },
+        404: {
+            "model": WrongResponsePredict,
+            "description": "Model doesnt exist",
+        },
+        429: {
+            "model": ResponseJobQueueIsFull,
+            "description": "There are too many jobs in the queue",
+        },
+    },
+)
+def submit(model_name: str, request: Predict) -> Dict[str, Any]:
     model = InferenceService.models.get(model_name)
     if not model:
-        logger.info("Predict get not existing model_name %s", model_name)
+        logger.info("Submit get not existing model_name %s", model_name)
         raise HTTPException(status_code=404, detail="Not existing model")
     if not model.ready:
         logger.info("%s isn't ready", model_name)
-        response.status_code = status.HTTP_202_ACCEPTED
         return {"status": "Model isn't ready"}
     try:
-        result = model.predict(request)
-    except Exception as err:
-        raise HTTPException(status_code=404, detail=f"{err}")
-    return result  # type: ignore
+        job = job_queue.submit(model_name, request)
+    except JobQueueIsFull:
+        raise HTTPException(status_code=429, detail="Job queue is full")
+    return {"job_id": job.id, "status": job.status}
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=ResponseJobStatus,
+    responses={
+        404: {
+            "model": WrongResponseJob,
+            "description": "Job doesnt exist",
+        },
+    },
+)
+def job_status(job_id: str) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Not existing job")
+    return job.to_dict()
+
+
+@router.get(
+    "/jobs/{job_id}/result",
+    responses={
+        200: {
+            "model": ResponsePredict,
+            "description": "The inference is done",
+        },
+        202: {
+            "model": ResponseJobStatus,
+            "description": "The job isn't finished yet",
+        },
+        404: {
+            "model": WrongResponseJob,
+            "description": "Job doesnt exist or is failed",
+        },
+    },
+)
+def job_result(job_id: str, response: Response) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Not existing job")
+    if job.status == Job.FAILED:
+        raise HTTPException(status_code=404, detail=job.detail)
+    if job.status != Job.DONE:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return job.to_dict()
+    return job.result  # type: ignore
+
+
+@router.get("/models", response_model=List[ResponseModel])
+def models() -> List[Dict[str, Any]]:
+    return [model.info() for model in InferenceService.models.values()]
+
+
+@router.get(
+    "/ready",
+    response_model=ResponseIsReady,
+    responses={
+        503: {
+            "model": ResponseIsReady,
+            "description": "The default model is loading or warming up",
+        },
+        404: {
+            "model": WrongResponseIsReady,
+            "description": "The default model is neither loaded nor loading",
+        },
+    },
+)
+def ready(response: Response) -> Dict[str, Any]:
+    return readiness(settings.model_name, response)
+
+
+@router.get(
+    "/models/{model_name}/ready",
+    response_model=ResponseIsReady,
+    responses={
+        503: {
+            "model": ResponseIsReady,
+            "description": "The model is loading or warming up",
+        },
+        404: {
+            "model": WrongResponseIsReady,
+            "description": "Model doesnt exist",
+        },
+    },
+)
+def model_ready(model_name: str, response: Response) -> Dict[str, Any]:
+    return readiness(model_name, response)
+
+
+def readiness(model_name: str, response: Response) -> Dict[str, Any]:
+    state = InferenceService.readiness(model_name)
+    if not state:
+        raise HTTPException(status_code=404, detail="Not existing model")
+    is_ready = state == InferenceService.READY
+    if not is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"is_ready": is_ready, "state": state}
+
+
+@router.post(
+    "/{model_name}:load",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {
+            "model": ResponseUpload,
+            "description": "The model is loading in background",
+        },
+        404: {
+            "model": WrongResponseUpload,
+            "description": "Checkpoint or config doesnt exist",
+        },
+        409: {
+            "model": WrongResponseUpload,
+            "description": "The model is already loading",
+        },
+    },
+)
+def load(model_name: str, request: LoadModel) -> Dict[str, Any]:
+    return start_loading(
+        model_name,
+        request.data_bucket,
+        request.data_file,
+        request.config_bucket,
+        request.config_file,
+        request.device or settings.device,
+    )
+
+
+@router.post(
+    "/{model_name}:reload",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {
+            "model": ResponseUpload,
+            "description": "The model is reloading in background",
+        },
+        404: {
+            "model": WrongResponseUpload,
+            "description": "Model, checkpoint or config doesnt exist",
+        },
+        409: {
+            "model": WrongResponseUpload,
+            "description": "The model is already loading",
+        },
+    },
+)
+def reload(model_name: str) -> Dict[str, Any]:
+    model = InferenceService.models.get(model_name)
+    if not model:
+        logger.info("Reload get not existing model_name %s", model_name)
+        raise HTTPException(status_code=404, detail="Not existing model")
+    return start_loading(
+        model_name,
+        model.data_bucket,
+        model.data_file,
+        model.config_bucket,
+        model.config_file,
+        model.device,
+    )
+
+
+@router.post(
+    "/{model_name}:unload",
+    responses={
+        200: {
+            "model": ResponseUpload,
+            "description": "The model is unloaded",
+        },
+        404: {
+            "model": WrongResponseUpload,
+            "description": "Model doesnt exist",
+        },
+    },
+)
+def unload(model_name: str) -> Dict[str, Any]:
+    if not InferenceService.remove_model(model_name):
+        logger.info("Unload get not existing model_name %s", model_name)
+        raise HTTPException(status_code=404, detail="Not existing model")
+    return {"model_name": model_name}
+
+
+def start_loading(
+    model_name: str,
+    data_bucket: str,
+    data_file: str,
+    config_bucket: str,
+    config_file: str,
+    device: str,
+) -> Dict[str, Any]:
+    missing = InferenceService.missing_files(
+        data_bucket, data_file, config_bucket, config_file
+    )
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Such files don't exist: {', '.join(missing)}",
+        )
+    if not InferenceService.load_in_background(
+        model_name, data_bucket, data_file, config_bucket, config_file, device
+    ):
+        raise HTTPException(
+            status_code=409, detail=f"{model_name} is already loading"
+        )
+    return {"model_name": model_name}
+
+
+@router.get("/scratch", response_model=ResponseScratchUsage)
+def scratch_usage() -> Dict[str, Any]:
+    return scratch_space.usage()
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    responses={
+        200: {
+            "content": {"text/plain": {}},
+            "description": "Metrics in Prometheus text format",
+        },
+    },
+)
+def metrics() -> Response:
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
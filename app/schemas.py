@@ -7,6 +7,20 @@ class Args(BaseModel):
     verbose: bool = Field(
         example=["false"],
     )
+    output_format: str = Field(
+        description="Format of every page in json with prediction:"
+        " 'objects' is a list of objects with id, bbox and category,"
+        " 'columnar' is arrays of ids, bboxes, categories and scores.",
+        example="objects",
+        default="objects",
+    )
+
+    # pylint: disable=no-self-argument
+    @validator("output_format")
+    def output_format_should_be_known(cls, name: str) -> str:
+        if name not in ("objects", "columnar"):
+            raise ValueError("output_format should be objects or columnar")
+        return name
 
 
 class Predict(BaseModel):
@@ -55,7 +69,7 @@ class Predict(BaseModel):
     )
     args: Optional[Args] = Field(
         description="If verbose true then model will save image with bboxes",
-        default={"verbose": True},
+        default=Args(verbose=True),
     )
 
     # pylint: disable=no-self-argument
@@ -82,8 +96,18 @@ class Predict(BaseModel):
         return name
 
 
+class PredictBatch(BaseModel):
+    items: List[Predict] = Field(
+        title="Items",
+        description="Predictions which are run as one workload,"
+        " every item is saved to its own output_path.",
+        min_items=1,
+    )
+
+
 class ResponseIsReady(BaseModel):
     is_ready: bool = Field(example=True)
+    state: str = Field(example="ready")
 
 
 class WrongResponseIsReady(BaseModel):
@@ -113,6 +137,90 @@ class ResponsePredictModelIsNotReady(BaseModel):
     status: str = Field(example="Model isn't ready")
 
 
+class ResponseBatchItem(BaseModel):
+    file: str = Field(example="test.pdf")
+    output_path: str = Field(example="runs/jobId/fileId/currentStepId.json")
+    status: str = Field(example="done")
+    detail: Optional[str] = Field(example=None)
+
+
+class ResponseBatch(BaseModel):
+    items: List[ResponseBatchItem]
+
+
+class ResponseJob(BaseModel):
+    job_id: str = Field(example="bb1a398a-7cc2-4711-83c2-ad6ca0f18780")
+    status: str = Field(example="queued")
+
+
+class ResponseJobStatus(ResponseJob):
+    model_name: str = Field(example="latex-detector")
+    output_bucket: str = Field(example="result")
+    output_path: str = Field(example="runs/jobId/fileId/currentStepId.json")
+    detail: Optional[str] = Field(example=None)
+
+
+class WrongResponseJob(BaseModel):
+    detail: str = Field(example="Not existing job")
+
+
+class ResponseJobQueueIsFull(BaseModel):
+    detail: str = Field(example="Job queue is full")
+
+
+class LoadModel(BaseModel):
+    data_bucket: str = Field(
+        title="Checkpoint bucket name",
+        description="The name of the bucket where the checkpoint is located",
+        example="test",
+    )
+    data_file: str = Field(
+        title="Checkpoint",
+        description="The full path to the pth-file inside the bucket",
+        example="latex-detector.pth",
+    )
+    config_bucket: str = Field(
+        title="Config bucket name",
+        description="The name of the bucket where the config is located",
+        example="test",
+    )
+    config_file: str = Field(
+        title="Config",
+        description="The full path to the py-file inside the bucket",
+        example="latex-detector.py",
+    )
+    device: Optional[str] = Field(
+        description="Device for the model. Settings are used if not set",
+        example="cpu",
+        default=None,
+    )
+
+    # pylint: disable=no-self-argument
+    @validator("data_file")
+    def data_file_should_be_pth(cls, name: str) -> str:
+        if not name.endswith(".pth"):
+            raise ValueError("data_file should be pth file")
+        return name
+
+    # pylint: disable=no-self-argument
+    @validator("config_file")
+    def config_file_should_be_py(cls, name: str) -> str:
+        if not name.endswith(".py"):
+            raise ValueError("config_file should be py file")
+        return name
+
+
+class ResponseModel(BaseModel):
+    model_name: str = Field(example="latex-detector")
+    is_ready: bool = Field(example=True)
+    version: str = Field(example="5d41402abc4b2a76b9719d911017c592")
+    backend: str = Field(example="torchscript+int8")
+    data_bucket: str = Field(example="test")
+    data_file: str = Field(example="latex-detector.pth")
+    config_bucket: str = Field(example="test")
+    config_file: str = Field(example="latex-detector.py")
+
+
 class ResponseUpload(BaseModel):
     model_name: str = Field(example="model is loaded")
 
@@ -124,6 +232,13 @@ class WrongResponseUpload(BaseModel):
     )
 
 
+class ResponseScratchUsage(BaseModel):
+    directory: str = Field(example="/dev/shm/scratch-1b2c3d4e")
+    workspaces: int = Field(example=2)
+    used_bytes: int = Field(example=73400320)
+    quota_bytes: int = Field(example=2147483648)
+
+
 class Size(BaseModel):
     width: float
     height: float
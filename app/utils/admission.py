@@ -0,0 +1,141 @@
+import threading
+import time
+from contextlib import contextmanager
+from types import TracebackType
+from typing import Dict, Iterator, Optional, Type
+
+from app.config import Settings
+from app.utils.logger_configure import configure_logging
+from app.utils.metrics import ERRORS, IN_FLIGHT, STAGE_SECONDS, Labels
+
+settings = Settings()
+
+logger = configure_logging(__file__)
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class AdmissionControl:
+    """Used for limiting pages and bytes of page images in flight.
+
+    Pages are admitted before they are rendered and released after their
+    boxes are extracted, so all requests together stay within the memory
+    budget. Work over the budget waits for released pages up to timeout
+    and is rejected after that. Zero limits are not checked, and work
+    bigger than the whole budget is admitted when nothing else runs
+    besides the held pages of the same request.
+    """
+
+    def __init__(self, max_pages: int, max_bytes: int, timeout: float) -> None:
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.pages = 0
+        self.bytes = 0
+        self.condition = threading.Condition()
+
+    def fits(self, pages: int, size: int, held: int = 0) -> bool:
+        if self.pages <= held:
+            return True
+        if self.max_pages and self.pages + pages > self.max_pages:
+            return False
+        return not self.max_bytes or self.bytes + size <= self.max_bytes
+
+    def acquire(self, pages: int, size: int, held: int = 0) -> None:
+        """Wait until pages and bytes fit the budget and take them.
+
+        Held is the number of pages the caller already holds, they don't
+        prevent admission of work bigger than the whole budget.
+        """
+
+        deadline = time.monotonic() + self.timeout
+        with self.condition, STAGE_SECONDS.time(stage="admission_wait"):
+            while not self.fits(pages, size, held):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.info("Reject %s pages of %s bytes", pages, size)
+                    ERRORS.inc(source="admission")
+                    raise AdmissionRejected(
+                        f"Memory budget is exhausted, {self.pages} pages "
+                        f"and {self.bytes} bytes are in flight"
+                    )
+                self.condition.wait(remaining)
+            self.pages += pages
+            self.bytes += size
+
+    def release(self, pages: int, size: int) -> None:
+        with self.condition:
+            self.pages -= pages
+            self.bytes -= size
+            self.condition.notify_all()
+
+    @contextmanager
+    def admit(self, pages: int, size: int) -> Iterator[None]:
+        """Hold pages and bytes of the budget while the block runs"""
+
+        self.acquire(pages, size)
+        try:
+            yield
+        finally:
+            self.release(pages, size)
+
+    def lease(self) -> "AdmissionLease":
+        return AdmissionLease(self)
+
+    def usage(self) -> Dict[Labels, float]:
+        with self.condition:
+            return {("pages",): self.pages, ("bytes",): self.bytes}
+
+
+class AdmissionLease:
+    """Used for holding the budget of one request admitted in windows.
+
+    Pages of a window are admitted at once, but they are released one by
+    one when they are done, because they may outlive their window in a
+    batch. Whatever is still held is released when the lease is closed.
+    """
+
+    def __init__(self, control: AdmissionControl) -> None:
+        self.control = control
+        self.pages = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "AdmissionLease":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def acquire(self, pages: int, size: int) -> None:
+        self.control.acquire(pages, size, held=self.pages)
+        with self.lock:
+            self.pages += pages
+            self.bytes += size
+
+    def release(self, pages: int, size: int) -> None:
+        with self.lock:
+            pages, size = min(pages, self.pages), min(size, self.bytes)
+            self.pages -= pages
+            self.bytes -= size
+        if pages or size:
+            self.control.release(pages, size)
+
+    def close(self) -> None:
+        self.release(self.pages, self.bytes)
+
+
+admission = AdmissionControl(
+    max_pages=settings.admission_max_pages,
+    max_bytes=settings.admission_max_bytes,
+    timeout=settings.admission_timeout,
+)
+
+IN_FLIGHT.set_function(admission.usage)
@@ -0,0 +1,137 @@
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Tuple
+
+import torch
+
+from app.utils.logger_configure import configure_logging
+
+logger = configure_logging(__file__)
+
+EAGER_BACKEND = "eager"
+TORCHSCRIPT_BACKEND = "torchscript"
+BACKENDS = (EAGER_BACKEND, TORCHSCRIPT_BACKEND)
+DEFAULT_IMG_SCALE = (1333, 800)
+
+
+class FeatureExtractor(torch.nn.Module):
+    """Backbone and neck of mmdet detector as one traceable module"""
+
+    def __init__(self, model: Any) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, img: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        return tuple(self.model.extract_feat(img))
+
+
+def backend_name(backend: str, quantize: bool) -> str:
+    return f"{backend}+int8" if quantize else backend
+
+
+def artefact_path(checkpoint_path: Path, backend: str) -> Path:
+    """Exported module is kept in the model cache next to its checkpoint"""
+
+    return checkpoint_path.with_name(f"{checkpoint_path.stem}.{backend}.pt")
+
+
+def example_shape(cfg: Any) -> Tuple[int, int]:
+    """Height and width of a padded input of the test pipeline"""
+
+    img_scale: Any = DEFAULT_IMG_SCALE
+    for step in cfg.data.test.pipeline:
+        if step.get("img_scale"):
+            img_scale = step["img_scale"]
+            break
+    if isinstance(img_scale, list):
+        img_scale = img_scale[0]
+    return (
+        math.ceil(max(img_scale) / 32) * 32,
+        math.ceil(min(img_scale) / 32) * 32,
+    )
+
+
+def quantize_linear_layers(model: Any) -> Any:
+    """Dynamic INT8 quantization of fully connected layers.
+
+    Convolutions are kept in fp32, the gain is in the heads with big fc
+    layers like the bbox head of two stage detectors.
+    """
+
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def trace_features(model: Any, path: Path) -> Any:
+    """Load traced backbone and neck from path or trace and save them"""
+
+    device = next(model.parameters()).device
+    if path.exists():
+        logger.info("Load traced features from %s", path)
+        return torch.jit.load(str(path), map_location=device)
+    height, width = example_shape(model.cfg)
+    example = torch.rand(1, 3, height, width, device=device)
+    logger.info("Trace features with input %s", tuple(example.shape))
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            FeatureExtractor(model).eval(), example, check_trace=False
+        )
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    os.close(fd)
+    torch.jit.save(traced, tmp_path)
+    os.replace(tmp_path, path)
+    return traced
+
+
+def check_traced(model: Any, traced: Any) -> bool:
+    """Compare traced and eager features on an input of another shape"""
+
+    height, width = example_shape(model.cfg)
+    img = torch.rand(
+        1, 3, width, height, device=next(model.parameters()).device
+    )
+    with torch.no_grad():
+        expected = model.extract_feat(img)
+        actual = traced(img)
+    return len(expected) == len(actual) and all(
+        torch.allclose(e, a, rtol=1e-3, atol=1e-4)
+        for e, a in zip(expected, actual)
+    )
+
+
+def optimize_model(
+    model: Any, backend: str, quantize: bool, checkpoint_path: Path
+) -> str:
+    """Switch detector loaded by init_detector to the selected backend.
+
+    The model stays mmdet detector with the same CLASSES and output, only
+    its feature extractor is replaced with TorchScript module and fc layers
+    with quantized ones. Returns the name of the backend which is used.
+    """
+
+    if backend not in BACKENDS:
+        logger.info("Unknown backend %s, use %s", backend, EAGER_BACKEND)
+        backend = EAGER_BACKEND
+    device = next(model.parameters()).device
+    if quantize and device.type != "cpu":
+        logger.info("Quantization is supported only on cpu")
+        quantize = False
+    if backend == TORCHSCRIPT_BACKEND:
+        try:
+            traced = trace_features(
+                model, artefact_path(checkpoint_path, backend)
+            )
+            if not check_traced(model, traced):
+                raise ValueError("traced features differ from eager ones")
+        except Exception as err:  # pylint: disable=broad-except
+            logger.info("Can't use %s backend: %s", backend, err)
+            backend = EAGER_BACKEND
+        else:
+            # instance attribute hides the method used by simple_test
+            object.__setattr__(model, "extract_feat", traced)
+    if quantize:
+        quantize_linear_layers(model)
+    return backend_name(backend, quantize)
@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.utils.logger_configure import configure_logging
+from app.utils.metrics import ERRORS
+
+logger = configure_logging(__file__)
+
+
+class BoundedExecutor:
+    """Used for running background tasks with a bounded queue.
+
+    Tasks submitted while max_pending tasks are waiting or running are
+    dropped, so slow background work never piles up in memory. If blocking
+    is set, they wait for a free slot instead, for tasks which must not be
+    lost.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_pending: int,
+        name: str,
+        blocking: bool = False,
+    ) -> None:
+        self.name = name
+        self.blocking = blocking
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> bool:
+        if not self.slots.acquire(blocking=self.blocking):
+            logger.info("Queue of %s is full, task is dropped", self.name)
+            return False
+        try:
+            self.executor.submit(self.run, fn, *args)
+        except RuntimeError:
+            self.slots.release()
+            raise
+        return True
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> None:
+        try:
+            fn(*args)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.info("Background task of %s is failed: %s", self.name, err)
+            ERRORS.inc(source=self.name)
+        finally:
+            self.slots.release()
@@ -0,0 +1,68 @@
+import copy
+from contextlib import nullcontext
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import torch
+from mmcv.ops import RoIPool
+from mmcv.parallel import collate, scatter
+from mmdet.datasets import replace_ImageToTensor
+from mmdet.datasets.pipelines import Compose
+
+from app.utils.images import Image
+from app.utils.metrics import BATCH_SIZE, STAGE_SECONDS
+
+
+def build_test_pipeline(cfg: Any, from_array: bool) -> Compose:
+    """Build test pipeline which supports batching for files or arrays"""
+
+    cfg = copy.deepcopy(cfg)
+    if from_array:
+        cfg.data.test.pipeline[0].type = "LoadImageFromWebcam"
+    cfg.data.test.pipeline = replace_ImageToTensor(cfg.data.test.pipeline)
+    return Compose(cfg.data.test.pipeline)
+
+
+def inference_detector_batch(
+    model: Any, imgs: Sequence[Image], metrics: bool = True
+) -> List[Any]:
+    """Inference a batch of images with the detector in one forward pass.
+
+    Images in a batch are padded to the same shape, so the result for each
+    image is the same as for `mmdet.apis.inference_detector`. Metrics are
+    not touched if metrics is unset, forked worker processes have a copy of
+    the registry whose locks may have been held by another thread at fork.
+    """
+
+    if not imgs:
+        return []
+    device = next(model.parameters()).device
+    pipelines: Dict[bool, Compose] = {}
+    datas = []
+    for img in imgs:
+        from_array = isinstance(img, np.ndarray)
+        if from_array not in pipelines:
+            pipelines[from_array] = build_test_pipeline(model.cfg, from_array)
+        sample: Dict[str, Any]
+        if from_array:
+            sample = dict(img=img)
+        else:
+            sample = dict(img_info=dict(filename=img), img_prefix=None)
+        datas.append(pipelines[from_array](sample))
+    data = collate(datas, samples_per_gpu=len(imgs))
+    data["img_metas"] = [img_metas.data[0] for img_metas in data["img_metas"]]
+    data["img"] = [img.data[0] for img in data["img"]]
+    if device.type == "cuda":
+        data = scatter(data, [device])[0]
+    else:
+        for module in model.modules():
+            assert not isinstance(
+                module, RoIPool
+            ), "CPU inference with RoIPool is not supported currently."
+
+    if metrics:
+        BATCH_SIZE.observe(len(imgs))
+    timer = STAGE_SECONDS.time(stage="forward") if metrics else nullcontext()
+    with torch.no_grad(), timer:
+        results: List[Any] = model(return_loss=False, rescale=True, **data)
+    return results
@@ -0,0 +1,110 @@
+import hashlib
+import io
+from typing import Any, List, Optional, Union
+
+import numpy as np
+from minio.error import S3Error
+
+from .cache import TTLCache
+from .images import ImageArray
+from .logger_configure import configure_logging
+from .metrics import CACHE_HITS, CACHE_MISSES
+from .minio import MinioDataLoader
+
+LOGGER = configure_logging(__file__)
+
+Detection = List[Any]
+
+
+class DetectionCache:
+    """Used for reusing detections of pages which were already predicted.
+
+    Keys are built from the content of the rendered page, dpi, score
+    threshold and etag of the checkpoint, so a retry of the same document
+    costs one hash per page instead of a forward pass. Detections are kept
+    in memory with LRU limit and, if bucket is set, in minio as npz files
+    shared between replicas. Boxes below the score threshold are dropped
+    before caching, because they never get into the response.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        minio_client: MinioDataLoader,
+        bucket: Optional[str] = None,
+        prefix: str = "detection_cache",
+    ) -> None:
+        self.memory: TTLCache[Detection] = TTLCache(ttl, max_size)
+        self.client = minio_client
+        self.bucket = bucket or ""
+        self.prefix = prefix
+        self.enabled = bool(max_size or bucket)
+
+    @staticmethod
+    def key(
+        content: Union[bytes, ImageArray],
+        dpi: float,
+        score_thr: float,
+        etag: str,
+    ) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{etag}/{dpi}/{score_thr}/".encode())
+        if isinstance(content, np.ndarray):
+            digest.update(str(content.shape).encode())
+            content = np.ascontiguousarray(content).data
+        digest.update(content)
+        return digest.hexdigest()
+
+    def object_name(self, key: str) -> str:
+        return f"{self.prefix}/{key}.npz"
+
+    def get(self, key: str) -> Optional[Detection]:
+        detection = self.memory.get(key)
+        if detection is None and self.bucket:
+            detection = self.get_from_minio(key)
+            if detection is not None:
+                self.memory.set(key, detection)
+        if detection is None:
+            CACHE_MISSES.inc(cache="detections")
+        else:
+            CACHE_HITS.inc(cache="detections")
+        return detection
+
+    def set(self, key: str, detection: Detection, score_thr: float) -> None:
+        """Cache bboxes of detection above score_thr.
+
+        Results of models with masks are not cached.
+        """
+
+        if not isinstance(detection, list):
+            return
+        filtered = [bboxes[bboxes[:, -1] > score_thr] for bboxes in detection]
+        self.memory.set(key, filtered)
+        if self.bucket:
+            self.put_to_minio(key, filtered)
+
+    def get_from_minio(self, key: str) -> Optional[Detection]:
+        try:
+            data = self.client.get_bytes(self.bucket, self.object_name(key))
+        except S3Error:
+            return None
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.info("Error %s while getting detection %s", err, key)
+            return None
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return [arrays[f"arr_{i}"] for i in range(len(arrays.files))]
+
+    def put_to_minio(self, key: str, detection: Detection) -> None:
+        buffer = io.BytesIO()
+        np.savez(buffer, *detection)
+        try:
+            if not self.client.bucket_exists(self.bucket):
+                self.client.make_bucket(self.bucket)
+            self.client.put_bytes(
+                self.bucket,
+                self.object_name(key),
+                buffer.getvalue(),
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.info("Error %s while caching detection %s", err, key)
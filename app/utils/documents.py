@@ -0,0 +1,37 @@
+from pathlib import Path
+from typing import Any
+
+import pdfplumber
+
+from app.utils.logger_configure import configure_logging
+from app.utils.metrics import STAGE_SECONDS
+from app.utils.minio import MinioDataLoader
+from app.utils.scratch import Workspace
+
+logger = configure_logging(__file__)
+
+
+class PdfDocument:
+    """Used for downloading pdf from minio once and sharing parsed document"""
+
+    def __init__(
+        self,
+        minio_client: MinioDataLoader,
+        bucket: str,
+        file: str,
+        workspace: Workspace,
+    ) -> None:
+        self.bucket = bucket
+        self.file = file
+        self.path = workspace.directory("documents") / Path(file).name
+        logger.info("Download document %s from bucket %s", file, bucket)
+        workspace.reserve(minio_client.stat_object(bucket, file).size)
+        with STAGE_SECONDS.time(stage="pdf_download"):
+            minio_client.fget_object(bucket, file, str(self.path))
+        self.pdf: Any = pdfplumber.open(self.path)
+
+    def close(self) -> None:
+        """Close parsed pdf and remove downloaded file"""
+
+        self.pdf.close()
+        self.path.unlink()
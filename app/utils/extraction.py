@@ -1,4 +1,4 @@
-import uuid
+import os
 from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
@@ -7,6 +7,26 @@ from app.config import Settings
 
 settings = Settings()
 
+OBJECTS_FORMAT = "objects"
+COLUMNAR_FORMAT = "columnar"
+
+
+def generate_ids(count: int) -> List[str]:
+    """Generate random uuid4 strings from one chunk of random bytes"""
+
+    raw = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(
+        count, 16
+    )
+    raw = raw.copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hexes = raw.tobytes().hex()
+    return [
+        f"{hexes[i:i + 8]}-{hexes[i + 8:i + 12]}-{hexes[i + 12:i + 16]}-"
+        f"{hexes[i + 16:i + 20]}-{hexes[i + 20:i + 32]}"
+        for i in range(0, 32 * count, 32)
+    ]
+
 
 def extract_boxes_from_result(
     classes: Tuple[str],
@@ -15,53 +35,84 @@ def extract_boxes_from_result(
     page_number: Optional[int] = 1,
     score_thr: float = settings.default_thresholds,
     document: bool = False,
+    output_format: str = OBJECTS_FORMAT,
+    scale: float = 1.0,
 ) -> Dict[str, Any]:
+    """Convert detector output into json of one page.
+
+    Bboxes are multiplied by scale first, if the detector got an image
+    in another resolution than the original one. For documents the
+    original resolution is settings.dpi and bboxes are converted to points.
+    """
+
     if len(result) == 2:
         bboxes_res, _ = result
     else:
         bboxes_res = result
-    bboxes = np.vstack(bboxes_res)  # type: ignore
-    labels = [
-        np.full(bbox.shape[0], i, dtype=np.int32)
-        for i, bbox in enumerate(bboxes_res)
-    ]
-    labels = np.concatenate(labels)  # type: ignore
+    bboxes = np.vstack(bboxes_res)
+    labels = np.repeat(
+        np.arange(len(bboxes_res), dtype=np.int32),
+        [bbox.shape[0] for bbox in bboxes_res],
+    )
     scores = bboxes[:, -1]
     filter_scores_with_threshold = scores > score_thr
     bboxes = bboxes[filter_scores_with_threshold, :]
     labels = labels[filter_scores_with_threshold]
+
+    if scale == 1:
+        coords = bboxes[:, :4].astype(np.int32)
+    else:
+        coords = (bboxes[:, :4] * scale).astype(np.int32)
+    if document:
+        points = coords * settings.inch_to_point / settings.dpi
+    else:
+        points = coords.astype(np.float64)
+    categories = np.asarray(classes, dtype=object)[labels].tolist()
+    ids = generate_ids(len(categories))
+
     output: Dict[str, Any] = {
         "page_num": page_number,
         "size": size,
-        "objs": [],
     }
-    for bbox, label in zip(bboxes, labels):
-        if document:
-            bbox = [
-                i * settings.inch_to_point / settings.dpi
-                for i in bbox.astype(np.int32)[:4]
-            ]
-        else:
-            bbox = [float(i) for i in bbox.astype(np.int32)[:4]]
-        id = str(uuid.uuid4())
-        category = classes[int(label)]
-        geom = {"id": id, "bbox": bbox, "category": category}
-        output["objs"].append(geom)
+    if output_format == COLUMNAR_FORMAT:
+        output["ids"] = ids
+        output["bboxes"] = points.tolist()
+        output["categories"] = categories
+        output["scores"] = bboxes[:, -1].tolist()
+    else:
+        output["objs"] = [
+            {"id": id, "bbox": bbox, "category": category}
+            for id, bbox, category in zip(ids, points.tolist(), categories)
+        ]
     return output
 
 
+def add_to_response(
+    response: Dict[str, Dict[str, Any]], page: Dict[str, Any]
+) -> None:
+    """Add ids of page objects to the response table by categories"""
+
+    page_num = page["page_num"]
+    if "objs" in page:
+        ids = [geom["id"] for geom in page["objs"]]
+        categories = [geom.get("category", None) for geom in page["objs"]]
+    else:
+        ids = page["ids"]
+        categories = page["categories"]
+    ids_array = np.asarray(ids, dtype=object)
+    categories_array = np.asarray(categories, dtype=object)
+    for category in dict.fromkeys(categories):
+        if not category:
+            continue
+        pages_for_label = response.setdefault(category, {})
+        page_ids = pages_for_label.setdefault(page_num, [])
+        page_ids.extend(ids_array[categories_array == category].tolist())
+
+
 def prepare_response(
     input_result: List[Dict[str, Any]]
 ) -> Dict[str, Dict[str, Any]]:
-    response = {}  # type: ignore
+    response: Dict[str, Dict[str, Any]] = {}
     for page in input_result:
-        page_num = page["page_num"]
-        for geom in page["objs"]:
-            category = geom.get("category", None)
-            if not category:
-                continue
-            id = geom["id"]
-            pages_for_label = response.setdefault(category, {})
-            ids = pages_for_label.setdefault(page_num, [])
-            ids.append(id)
+        add_to_response(response, page)
     return response
@@ -0,0 +1,91 @@
+import struct
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import numpy.typing as npt
+from cv2 import cv2
+
+ImageArray = npt.NDArray[np.uint8]
+Image = Union[str, ImageArray]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8, *range(0xD0, 0xD8)}
+JPEG_APP1 = 0xE1
+
+
+def probe_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read width and height from PNG or JPEG header without decoding.
+
+    None is returned for other formats, truncated headers and JPEG with
+    EXIF, because decoder may rotate such image by its orientation tag.
+    """
+
+    if data[:8] == PNG_SIGNATURE and data[12:16] == b"IHDR":
+        if len(data) < 24:
+            return None
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        if marker == JPEG_APP1 and data[offset + 4 : offset + 8] == b"Exif":
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def decode_image(data: bytes) -> ImageArray:
+    """Decode encoded image into BGR array like cv2.imread does.
+
+    ValueError is raised for data which can't be decoded, cv2 returns None
+    for it and detector would take None for a file name.
+    """
+
+    image: Optional[ImageArray] = cv2.imdecode(
+        np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR
+    )
+    if image is None:
+        raise ValueError(f"Image of {len(data)} bytes can't be decoded")
+    return image
+
+
+def resize_image(image: ImageArray, factor: float) -> ImageArray:
+    """Scale image by factor, INTER_AREA is used for downscaling"""
+
+    if factor == 1:
+        return image
+    height, width = image.shape[:2]
+    resized: ImageArray = cv2.resize(
+        image,
+        (max(1, round(width * factor)), max(1, round(height * factor))),
+        interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR,
+    )
+    return resized
+
+
+def synthetic_page(width: int, height: int) -> ImageArray:
+    """White page with dark lines of text-like blocks"""
+
+    page: ImageArray = np.full((height, width, 3), 255, dtype=np.uint8)
+    margin, line = width // 10, max(4, height // 60)
+    for top in range(margin, height - margin - line, line * 2):
+        right = width - margin - (top * 7 % (width // 3 or 1))
+        page[top : top + line // 2, margin:right] = 0
+    return page
@@ -0,0 +1,252 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+class Metric(ABC):
+    """Base of metrics exposed in Prometheus text format"""
+
+    kind = ""
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        """Suffix, label values and value of every sample"""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, values, value in self.samples():
+            names = self.label_names + (("le",) if suffix == "_bucket" else ())
+            lines.append(
+                f"{self.name}{suffix}{format_labels(names, values)} {value}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self.lock:
+            return [("", key, value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Gauge with values set directly or collected by a function on scrape"""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Labels, float] = {}
+        self.functions: List[Callable[[], Dict[Labels, float]]] = []
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+    def set_function(
+        self, function: Callable[[], Dict[Labels, float]]
+    ) -> None:
+        with self.lock:
+            self.functions.append(function)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self.lock:
+            values = dict(self.values)
+            functions = list(self.functions)
+        for function in functions:
+            values.update(function())
+        return [("", key, value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples: List[Tuple[str, Labels, float]] = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                total = 0
+                for bound, count in zip(self.buckets + (None,), counts):
+                    total += count
+                    le = "+Inf" if bound is None else repr(float(bound))
+                    samples.append(("_bucket", key + (le,), total))
+                samples.append(("_sum", key, self.sums[key]))
+                samples.append(("_count", key, total))
+        return samples
+
+
+class Registry:
+    """Used for collecting metrics for the /metrics endpoint"""
+
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def get(self, name: str) -> Optional[Metric]:
+        return next((m for m in self.metrics if m.name == name), None)
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "latex_detector_stage_seconds",
+    "Duration of pipeline stages: pdf_download, page_sizes, render_page, "
+    "minio_download, minio_upload, forward, extraction, result_upload, "
+    "warm_up, admission_wait",
+    labels=("stage",),
+)
+BATCH_SIZE = Histogram(
+    "latex_detector_forward_batch_size",
+    "Number of images in one forward pass of the detector",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+PAGES = Counter(
+    "latex_detector_pages_total", "Pages and images passed to the detector"
+)
+BOXES = Counter(
+    "latex_detector_boxes_total", "Boxes returned after score threshold"
+)
+CACHE_HITS = Counter(
+    "latex_detector_cache_hits_total", "Cache hits", labels=("cache",)
+)
+CACHE_MISSES = Counter(
+    "latex_detector_cache_misses_total", "Cache misses", labels=("cache",)
+)
+ERRORS = Counter(
+    "latex_detector_errors_total",
+    "Failed requests and background tasks",
+    labels=("source",),
+)
+QUEUE_DEPTH = Gauge(
+    "latex_detector_queue_depth",
+    "Number of items waiting in queues",
+    labels=("queue",),
+)
+MODEL_READY = Gauge(
+    "latex_detector_model_ready",
+    "1 if the model is loaded and ready for predictions",
+    labels=("model",),
+)
+IN_FLIGHT = Gauge(
+    "latex_detector_in_flight",
+    "Pages and bytes of page images admitted for processing",
+    labels=("resource",),
+)
+
+for _metric in (
+    STAGE_SECONDS,
+    BATCH_SIZE,
+    PAGES,
+    BOXES,
+    CACHE_HITS,
+    CACHE_MISSES,
+    ERRORS,
+    QUEUE_DEPTH,
+    MODEL_READY,
+    IN_FLIGHT,
+):
+    REGISTRY.register(_metric)
@@ -1,9 +1,15 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from pathlib import Path
-from typing import Union
+from typing import Any, Iterable, List, Optional, Set, Tuple, Union
 
+import urllib3
 from minio import Minio
 
+from .cache import TTLCache
 from .logger_configure import configure_logging
+from .metrics import CACHE_HITS, CACHE_MISSES, STAGE_SECONDS
 
 LOGGER = configure_logging(__file__)
 
@@ -20,14 +26,156 @@ class MinioDataLoader(Minio):  # type: ignore
     """Used for upload and download files from Minio"""
 
     def __init__(
-        self, endpoint: str, access_key: str, secret_key: str
+        self,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        pool_size: int = 10,
+        transfer_workers: int = 1,
+        metadata_ttl: float = 0,
+        metadata_max_size: int = 1024,
     ) -> None:
+        timeout = timedelta(minutes=5).seconds
         super().__init__(
             endpoint=endpoint,
             access_key=access_key,
             secret_key=secret_key,
             secure=False,
+            http_client=urllib3.PoolManager(
+                timeout=urllib3.util.Timeout(connect=timeout, read=timeout),
+                maxsize=pool_size,
+                retries=urllib3.Retry(
+                    total=5,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504],
+                ),
+            ),
         )
+        self.transfer_executor = ThreadPoolExecutor(
+            max_workers=transfer_workers, thread_name_prefix="minio"
+        )
+        self.buckets_cache: TTLCache[bool] = TTLCache(
+            metadata_ttl, metadata_max_size
+        )
+        self.listing_cache: TTLCache[Set[str]] = TTLCache(
+            metadata_ttl, metadata_max_size
+        )
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        """Check bucket existence, existing buckets are cached for a ttl"""
+
+        if self.buckets_cache.get(bucket_name):
+            CACHE_HITS.inc(cache="buckets")
+            return True
+        CACHE_MISSES.inc(cache="buckets")
+        exists: bool = super().bucket_exists(bucket_name)
+        if exists:
+            self.buckets_cache.set(bucket_name, True)
+        return exists
+
+    def make_bucket(self, bucket_name: str, *args: Any, **kwargs: Any) -> None:
+        super().make_bucket(bucket_name, *args, **kwargs)
+        self.buckets_cache.set(bucket_name, True)
+
+    def list_object_names(self, bucket: str, prefix: str) -> Set[str]:
+        """Names of all objects under prefix, cached for a ttl"""
+
+        names: Optional[Set[str]] = self.listing_cache.get((bucket, prefix))
+        if names is not None:
+            CACHE_HITS.inc(cache="listing")
+        else:
+            CACHE_MISSES.inc(cache="listing")
+            names = {
+                element.object_name
+                for element in self.list_objects(
+                    bucket, prefix=prefix, recursive=True
+                )
+            }
+            self.listing_cache.set((bucket, prefix), names)
+        return names
+
+    def add_object_names(
+        self, bucket: str, prefix: str, names: Iterable[str]
+    ) -> None:
+        """Add uploaded objects to the cached listing of prefix"""
+
+        cached = self.listing_cache.get((bucket, prefix))
+        if cached is not None:
+            self.listing_cache.set((bucket, prefix), cached | set(names))
+
+    def put_bytes(
+        self,
+        bucket: str,
+        file: str,
+        data: bytes,
+        content_type: str = "application/octet-stream",
+    ) -> None:
+        """Upload bytes from memory without temporary file"""
+
+        with STAGE_SECONDS.time(stage="minio_upload"):
+            self.put_object(
+                bucket, file, io.BytesIO(data), len(data), content_type
+            )
+
+    def get_bytes(self, bucket: str, file: str) -> bytes:
+        """Download object into memory without temporary file"""
+
+        with STAGE_SECONDS.time(stage="minio_download"):
+            response = self.get_object(bucket, file)
+            try:
+                data: bytes = response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        return data
+
+    def get_many_bytes(self, bucket: str, files: Iterable[str]) -> List[bytes]:
+        """Download objects into memory in parallel, keeping their order"""
+
+        return list(
+            self.transfer_executor.map(
+                lambda file: self.get_bytes(bucket, file), files
+            )
+        )
+
+    def put_many_bytes(
+        self,
+        bucket: str,
+        objects: Iterable[Tuple[str, bytes]],
+        content_type: str = "application/octet-stream",
+    ) -> None:
+        """Upload pairs of object and data in parallel"""
+
+        list(
+            self.transfer_executor.map(
+                lambda pair: self.put_bytes(
+                    bucket, pair[0], pair[1], content_type
+                ),
+                objects,
+            )
+        )
+
+    def download_files(
+        self, bucket: str, files: Iterable[Tuple[str, Path]]
+    ) -> None:
+        """Download pairs of object and local path in parallel"""
+
+        def download(pair: Tuple[str, Path]) -> None:
+            with STAGE_SECONDS.time(stage="minio_download"):
+                self.fget_object(bucket, pair[0], str(pair[1]))
+
+        list(self.transfer_executor.map(download, files))
+
+    def upload_files(
+        self, bucket: str, files: Iterable[Tuple[str, Path]]
+    ) -> None:
+        """Upload pairs of object and local path in parallel"""
+
+        def upload(pair: Tuple[str, Path]) -> None:
+            with STAGE_SECONDS.time(stage="minio_upload"):
+                self.fput_object(bucket, pair[0], str(pair[1]))
+
+        list(self.transfer_executor.map(upload, files))
 
     def download_file_from_minio(
         self, bucket: str, file: str, output_path: Path
@@ -57,14 +205,16 @@ class MinioDataLoader(Minio):  # type: ignore
             "Upload files from directory %s to bucket %s", directory, bucket
         )
         try:
-            for file in Path(directory).glob("**/*.*"):
-                self.fput_object(
-                    bucket,
-                    str(
-                        Path(path_in_minio) / Path(file).relative_to(directory)
-                    ),
-                    Path(file),
-                )
+            self.upload_files(
+                bucket,
+                (
+                    (
+                        str(Path(path_in_minio) / file.relative_to(directory)),
+                        file,
+                    )
+                    for file in Path(directory).glob("**/*.*")
+                ),
+            )
             return True
         except ValueError as e:
             LOGGER.info("Error %s while upload file into minio", e)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from minio.error import S3Error
+
+from .logger_configure import configure_logging
+from .metrics import CACHE_HITS, CACHE_MISSES
+from .minio import MinioDataLoader
+
+LOGGER = configure_logging(__file__)
+
+
+class CachedObject(NamedTuple):
+    path: Path
+    etag: str
+
+
+class ModelCache:
+    """Used for keeping checkpoints and configs from minio on local disk.
+
+    Files are stored by the hash of bucket/object/etag, so a changed object
+    on minio is downloaded again and an unchanged one only costs a stat.
+    The least recently used entries are removed when the cache is bigger
+    than max_bytes.
+    """
+
+    def __init__(
+        self, minio_client: MinioDataLoader, directory: Path, max_bytes: int
+    ) -> None:
+        self.client = minio_client
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def get(self, bucket: str, file: str) -> Optional[CachedObject]:
+        """Return local copy of the object, download it if it is needed"""
+
+        try:
+            etag = self.client.stat_object(bucket, file).etag
+        except S3Error as err:
+            LOGGER.info("Can't stat %s/%s: %s", bucket, file, err)
+            return None
+        key = hashlib.sha256(f"{bucket}/{file}/{etag}".encode()).hexdigest()
+        entry = self.directory / key
+        path = entry / Path(file).name
+        with self.lock:
+            if path.exists():
+                LOGGER.info("Use cached %s/%s from %s", bucket, file, path)
+                os.utime(entry)
+                CACHE_HITS.inc(cache="model")
+                return CachedObject(path, etag)
+            CACHE_MISSES.inc(cache="model")
+            LOGGER.info("Download %s/%s to cache %s", bucket, file, path)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_entry = Path(tempfile.mkdtemp(dir=self.directory))
+            try:
+                self.client.fget_object(
+                    bucket, file, str(tmp_entry / path.name)
+                )
+                tmp_entry.rename(entry)
+            finally:
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+            self.evict(keep=entry)
+        return CachedObject(path, etag)
+
+    def entries(self) -> List[Path]:
+        return sorted(
+            (entry for entry in self.directory.iterdir() if entry.is_dir()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+
+    @staticmethod
+    def entry_size(entry: Path) -> int:
+        return sum(
+            file.stat().st_size for file in entry.rglob("*") if file.is_file()
+        )
+
+    def size(self) -> int:
+        if not self.directory.exists():
+            return 0
+        return sum(self.entry_size(entry) for entry in self.entries())
+
+    def evict(self, keep: Path) -> None:
+        """Remove least recently used entries above max_bytes"""
+
+        entries = self.entries()
+        total = sum(self.entry_size(entry) for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            LOGGER.info("Evict %s from model cache", entry)
+            total -= self.entry_size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
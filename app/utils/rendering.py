@@ -1,29 +1,237 @@
-import tempfile
+import io
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import Dict, List, Union
+from types import TracebackType
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
+import numpy as np
 import pdfplumber
+from cv2 import cv2
 
+from app.config import Settings
 from app.schemas import Size
+from app.utils.background import BoundedExecutor
+from app.utils.documents import PdfDocument
+from app.utils.images import ImageArray, resize_image
 from app.utils.logger_configure import configure_logging
+from app.utils.metrics import ERRORS, STAGE_SECONDS
 from app.utils.minio import MinioDataLoader
+from app.utils.scratch import Workspace, scratch_space
+
+settings = Settings()
 
 logger = configure_logging(__file__)
 
+# Rendering waits for uploads when the queue is full, rendered images are
+# cached for other steps and dropping one would leave a hole among them.
+write_behind_executor = BoundedExecutor(
+    workers=settings.write_behind_workers,
+    max_pending=settings.write_behind_queue_size,
+    name="write-behind",
+    blocking=True,
+)
+
+render_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_render_executor(workers: int) -> ProcessPoolExecutor:
+    """Create process pool for rendering on the first call"""
+
+    global render_executor  # pylint: disable=global-statement
+    if render_executor is None:
+        render_executor = ProcessPoolExecutor(max_workers=workers)
+    return render_executor
+
+
+def reset_render_executor(broken: ProcessPoolExecutor) -> None:
+    """Drop broken process pool, the next call creates a new one"""
+
+    global render_executor  # pylint: disable=global-statement
+    if render_executor is broken:
+        render_executor = None
+    broken.shutdown(wait=False)
+
+
+RenderedPage = Tuple[int, Optional[ImageArray], Optional[bytes], float]
+
+
+def encode_page_image(img: Any, image_format: str) -> bytes:
+    """Encode rendered pdfplumber page image"""
+
+    buffer = io.BytesIO()
+    img.original.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def page_image_to_array(img: Any) -> ImageArray:
+    """BGR array of rendered pdfplumber page image"""
+
+    image: ImageArray = cv2.cvtColor(
+        np.asarray(img.original), cv2.COLOR_RGB2BGR
+    )
+    return image
+
+
+def encode_page(page: Any, dpi: float, image_format: str) -> bytes:
+    """Render pdfplumber page into encoded image"""
+
+    return encode_page_image(page.to_image(resolution=dpi), image_format)
+
+
+def render_pages(
+    pdf_path: str,
+    pages: List[Tuple[int, float]],
+    image_format: str,
+    arrays: bool = False,
+    encoded: Optional[Collection[int]] = None,
+) -> List[RenderedPage]:
+    """Render pairs of page and dpi in a worker process.
+
+    Pages are returned as BGR arrays if arrays is set, and as encoded
+    images if they are in encoded, all pages are encoded by default. Both
+    are made from one rendering, so nothing is decoded or encoded twice.
+    Rendering time of every page is returned as well, because metrics of
+    the worker process aren't visible in the main one. Only the pages of
+    the chunk are parsed, not the whole document.
+    """
+
+    rendered = []
+    with pdfplumber.open(pdf_path, pages=[page for page, _ in pages]) as pdf:
+        parsed = {page.page_number: page for page in pdf.pages}
+        for page_number, dpi in pages:
+            start = time.perf_counter()
+            img = parsed[page_number].to_image(resolution=dpi)
+            image = page_image_to_array(img) if arrays else None
+            data = None
+            if encoded is None or page_number in encoded:
+                data = encode_page_image(img, image_format)
+            rendered.append(
+                (page_number, image, data, time.perf_counter() - start)
+            )
+    return rendered
+
+
+def detection_dpi(size: Size, dpi: float, max_side: int = 0) -> float:
+    """Resolution of the page for the detector.
+
+    If max_side is set, it is lowered for big pages, so the longest side of
+    the image is not bigger than max_side pixels.
+    """
+
+    if max_side:
+        longest = max(size.width, size.height)
+        dpi = min(dpi, max_side * settings.inch_to_point / longest)
+    return dpi
+
+
+def page_bytes(size: Size, dpi: float) -> int:
+    """Size of BGR array of the page rendered in dpi"""
+
+    scale = dpi / settings.inch_to_point
+    return math.ceil(size.width * scale) * math.ceil(size.height * scale) * 3
+
+
+def save_image_on_minio(
+    client: MinioDataLoader,
+    bucket: str,
+    object_name: str,
+    image: Union[ImageArray, bytes],
+    image_format: str,
+) -> None:
+    """Encode rendered page if it is needed and put it on minio"""
+
+    try:
+        if isinstance(image, np.ndarray):
+            _, encoded = cv2.imencode(f".{image_format}", image)
+            data = encoded.tobytes()
+        else:
+            data = image
+        client.put_bytes(bucket, object_name, data, f"image/{image_format}")
+        client.add_object_names(
+            bucket, object_name.rsplit("/", 1)[0], [object_name]
+        )
+    except Exception as err:  # pylint: disable=broad-except
+        logger.info("Error %s while caching %s on minio", err, object_name)
+        ERRORS.inc(source="write-behind")
+
 
 class RenderImages:
     """Used for rendering images with parametrize DPI and format"""
 
     def __init__(
-        self, dpi: int, image_format: str, minio_client: MinioDataLoader
+        self,
+        dpi: int,
+        image_format: str,
+        minio_client: MinioDataLoader,
+        workers: int = 1,
     ) -> None:
         self.dpi = dpi
         self.image_format = image_format
+        self.workers = workers
         self.client = minio_client
         self.file_dir = ""
         self.file_name = ""
         self.size_pages = Dict[int, Size]
+        self.document: Optional[PdfDocument] = None
+        self.workspace: Optional[Workspace] = None
+
+    def __enter__(self) -> "RenderImages":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def open_document(self, bucket: str, file: str) -> PdfDocument:
+        """Download and parse pdf once for all calls with the same file"""
+
+        if self.document is None or (
+            self.document.bucket,
+            self.document.file,
+        ) != (bucket, file):
+            self.close_document()
+            self.document = PdfDocument(
+                self.client, bucket, file, self.get_workspace()
+            )
+        return self.document
+
+    def get_workspace(self) -> Workspace:
+        """Scratch directory for files of this renderer"""
+
+        if self.workspace is None:
+            self.workspace = scratch_space.workspace()
+        return self.workspace
+
+    def close_document(self) -> None:
+        if self.document is not None:
+            self.document.close()
+            self.document = None
+
+    def close(self) -> None:
+        """Release opened document and remove temporary files"""
+
+        self.close_document()
+        if self.workspace is not None:
+            self.workspace.cleanup()
+            self.workspace = None
 
     def check_pages_in_minio(
         self, bucket: str, file: str, pages: List[int]
@@ -36,63 +244,208 @@ class RenderImages:
             self.file_dir = ""
             self.file_name = file
         self.file_dir = f"{self.file_dir}/images_{self.dpi}"
-        minio_pages = [
-            element.object_name
-            for element in self.client.list_objects(
-                bucket, prefix=self.file_dir, recursive=True
-            )
+        minio_pages = self.client.list_object_names(bucket, self.file_dir)
+        return [
+            page
+            for page in pages
+            if f"{self.file_dir}/{self.name_image(page)}" not in minio_pages
         ]
-        return list(
-            filter(
-                lambda x: f"{self.file_dir}/{self.name_image(x)}"
-                not in minio_pages,
-                pages,
-            )
-        )
 
     def render(self, bucket: str, file: str, pages: List[int]) -> List[str]:
-        """Rendering images from pdf"""
+        """Rendering images from pdf and putting missing ones on minio.
+
+        Every page is uploaded from memory while the next one is rendered,
+        so nothing is written to the scratch space.
+        """
 
-        dir_with_images = TemporaryDirectory()
         pages_after_check = self.check_pages_in_minio(bucket, file, pages)
-        self.client.download_file_from_minio(
-            bucket, file, Path(dir_with_images.name) / self.file_name
-        )
 
         if pages_after_check:
             logger.info(
                 "Start rendering images from file %s for pages %s",
                 file,
-                pages,
+                pages_after_check,
             )
-            with pdfplumber.open(
-                Path(dir_with_images.name) / self.file_name
-            ) as pdf:
-                for page_number in pages_after_check:
-                    page = pdf.pages[page_number - 1]
-                    img = page.to_image(resolution=self.dpi)
-                    filename = Path(dir_with_images.name) / self.name_image(
-                        page_number
+            document = self.open_document(bucket, file)
+            self.client.put_many_bytes(
+                bucket,
+                (
+                    (f"{self.file_dir}/{self.name_image(page_number)}", data)
+                    for page_number, data in self.render_encoded(
+                        document, pages_after_check
                     )
-                    img.save(filename, format=self.image_format)
-            (Path(dir_with_images.name) / self.file_name).unlink()
-            self.client.upload_files_to_minio(
-                dir_with_images.name, bucket, self.file_dir
+                ),
+                f"image/{self.image_format}",
+            )
+            self.client.add_object_names(
+                bucket,
+                self.file_dir,
+                (
+                    f"{self.file_dir}/{self.name_image(page)}"
+                    for page in pages_after_check
+                ),
             )
-            dir_with_images.cleanup()
 
         return [f"{self.file_dir}/{x}.{self.image_format}" for x in pages]
 
+    def render_to_arrays(
+        self,
+        bucket: str,
+        file: str,
+        pages: List[int],
+        cache: bool = True,
+        resolutions: Optional[Dict[int, float]] = None,
+    ) -> Iterator[Tuple[str, ImageArray]]:
+        """Rendering images from pdf into memory.
+
+        Yields object name of the page image together with BGR array of the
+        page in resolution from resolutions, dpi by default. If cache is
+        set, pages missing on minio are uploaded there in background in dpi
+        resolution. Then all pages are rendered in dpi and resized, not only
+        the missing ones, so a page has the same pixels whether it was on
+        minio or not and a retry hits the detection cache. Without cache
+        pages are rendered right in the needed resolution.
+        """
+
+        missing_pages = set(self.check_pages_in_minio(bucket, file, pages))
+        pages_to_cache = missing_pages if cache else set()
+        resolutions = resolutions or {}
+        render_resolutions = {
+            page: self.dpi if cache else resolutions.get(page, self.dpi)
+            for page in pages
+        }
+        document = self.open_document(bucket, file)
+        logger.info(
+            "Start rendering images in memory from file %s for pages %s",
+            file,
+            pages,
+        )
+        for page_number, image, data in self.render_pages_to_arrays(
+            document, pages, render_resolutions, encoded=pages_to_cache
+        ):
+            image_name = f"{self.file_dir}/{self.name_image(page_number)}"
+            if page_number in pages_to_cache:
+                write_behind_executor.submit(
+                    save_image_on_minio,
+                    self.client,
+                    bucket,
+                    image_name,
+                    image if data is None else data,
+                    self.image_format,
+                )
+            rendered_dpi = render_resolutions[page_number]
+            factor = resolutions.get(page_number, rendered_dpi) / rendered_dpi
+            yield image_name, resize_image(image, factor)
+
+    def render_pages_to_arrays(
+        self,
+        document: PdfDocument,
+        pages: List[int],
+        resolutions: Optional[Dict[int, float]] = None,
+        encoded: Collection[int] = (),
+    ) -> Iterator[Tuple[int, ImageArray, Optional[bytes]]]:
+        """Rendering pages into BGR arrays, in process pool if it is set.
+
+        Workers also encode pages from encoded, because they have to be put
+        on minio, otherwise encoded images are None.
+        """
+
+        resolutions = resolutions or {}
+        if self.workers > 1:
+            yield from self.render_in_workers(  # type: ignore
+                document, pages, resolutions, arrays=True, encoded=encoded
+            )
+            return
+        for page_number in pages:
+            page = document.pdf.pages[page_number - 1]
+            with STAGE_SECONDS.time(stage="render_page"):
+                image = page_image_to_array(
+                    page.to_image(
+                        resolution=resolutions.get(page_number, self.dpi)
+                    )
+                )
+            yield page_number, image, None
+
+    def render_encoded(
+        self, document: PdfDocument, pages: List[int]
+    ) -> Iterator[Tuple[int, bytes]]:
+        """Rendering pages into encoded images, in process pool if it is set"""
+
+        if self.workers > 1:
+            for page_number, _, data in self.render_in_workers(
+                document, pages
+            ):
+                yield page_number, data  # type: ignore
+            return
+        for page_number in pages:
+            page = document.pdf.pages[page_number - 1]
+            with STAGE_SECONDS.time(stage="render_page"):
+                data = encode_page(page, self.dpi, self.image_format)
+            yield page_number, data
+
+    def render_in_workers(
+        self,
+        document: PdfDocument,
+        pages: List[int],
+        resolutions: Optional[Dict[int, float]] = None,
+        arrays: bool = False,
+        encoded: Optional[Collection[int]] = None,
+    ) -> Iterator[Tuple[int, Optional[ImageArray], Optional[bytes]]]:
+        """Split pages across worker processes and render them in parallel.
+
+        Every worker opens the already downloaded pdf by itself, because
+        parsed pdfplumber document can't be passed between processes. If a
+        worker dies, e.g. killed by OOM, the pool is replaced and the chunks
+        which aren't rendered yet are retried once.
+        """
+
+        resolutions = resolutions or {}
+        chunk_size = max(1, math.ceil(len(pages) / self.workers))
+        chunks = [
+            [
+                (page, resolutions.get(page, self.dpi))
+                for page in pages[start : start + chunk_size]
+            ]
+            for start in range(0, len(pages), chunk_size)
+        ]
+        logger.info(
+            "Rendering %s pages in %s worker processes",
+            len(pages),
+            len(chunks),
+        )
+        done = 0
+        for attempt in range(2):
+            executor = get_render_executor(self.workers)
+            try:
+                for rendered in executor.map(
+                    render_pages,
+                    repeat(str(document.path)),
+                    chunks[done:],
+                    repeat(self.image_format),
+                    repeat(arrays),
+                    repeat(None if encoded is None else set(encoded)),
+                ):
+                    for page_number, image, data, seconds in rendered:
+                        STAGE_SECONDS.observe(seconds, stage="render_page")
+                        yield page_number, image, data
+                    done += 1
+                return
+            except BrokenProcessPool:
+                reset_render_executor(executor)
+                ERRORS.inc(source="render-workers")
+                if attempt:
+                    raise
+                logger.info("Render workers are broken, start new ones")
+
     def get_size_pages(
         self, file: Union[str, Path], bucket: str, pages: List[int]
     ) -> Dict[int, Size]:
-        tmp_path = Path(tempfile.mkdtemp()) / "document.pdf"
-        self.client.fget_object(bucket, file, str(tmp_path))
-        with pdfplumber.open(tmp_path) as f:
+        pdf = self.open_document(bucket, str(file)).pdf
+        with STAGE_SECONDS.time(stage="page_sizes"):
             sizes = dict.fromkeys(pages)
             res = {
                 page.page_number: Size(width=page.width, height=page.height)
-                for page in f.pages
+                for page in pdf.pages
                 if page.page_number in sizes
             }
         return res
@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Optional, TextIO, Type
+
+from app.utils.extraction import add_to_response
+from app.utils.scratch import Workspace, scratch_space
+
+
+class ResultSpool:
+    """Used for writing output json of a document page by page.
+
+    Predictions are appended to a file in the scratch space as they are
+    done and only the response table is kept in memory, so memory doesn't
+    grow with the number of pages. The file is uploaded after the last page.
+    """
+
+    def __init__(self) -> None:
+        self.workspace: Workspace = scratch_space.workspace()
+        self.path = self.workspace.directory("results") / "result.json"
+        self.file: TextIO = self.path.open("w")
+        self.file.write('{"pages": [')
+        self.pages = 0
+        self.response: Dict[str, Dict[str, Any]] = {}
+
+    def __enter__(self) -> "ResultSpool":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+    def add(self, prediction: Dict[str, Any]) -> None:
+        data = json.dumps(prediction)
+        if self.pages:
+            data = f", {data}"
+        self.workspace.reserve(len(data))
+        self.file.write(data)
+        self.pages += 1
+        add_to_response(self.response, prediction)
+
+    def finish(self) -> Path:
+        """Complete json and return path to the file for uploading"""
+
+        self.file.write("]}")
+        self.file.close()
+        return self.path
+
+    def close(self) -> None:
+        self.file.close()
+        self.workspace.cleanup()
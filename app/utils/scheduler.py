@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from app.utils.images import Image
+from app.utils.logger_configure import configure_logging
+
+logger = configure_logging(__file__)
+
+
+class BatchScheduler:
+    """Used for gathering images of concurrent requests into one batch.
+
+    A batch is sent to the detector when it has max_batch_size images or
+    when max_wait seconds have passed since its first image was submitted.
+    """
+
+    def __init__(
+        self,
+        detect: Callable[[List[Image]], List[Any]],
+        max_batch_size: int,
+        max_wait: float,
+    ) -> None:
+        self.detect_batch = detect
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: "queue.Queue[Optional[Tuple[Image, Future[Any]]]]" = (
+            queue.Queue()
+        )
+        self.thread = threading.Thread(
+            target=self.run, name="batch-scheduler", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, img: Image) -> "Future[Any]":
+        future: "Future[Any]" = Future()
+        self.queue.put((img, future))
+        return future
+
+    def detect(self, imgs: Sequence[Image]) -> List[Any]:
+        """Submit images and wait for detections in the same order"""
+
+        futures = [self.submit(img) for img in imgs]
+        return [future.result() for future in futures]
+
+    def size(self) -> int:
+        return self.queue.qsize()
+
+    def stop(self) -> None:
+        self.queue.put(None)
+
+    def collect_batch(
+        self, first: Tuple[Image, "Future[Any]"]
+    ) -> Tuple[List[Tuple[Image, "Future[Any]"]], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def run(self) -> None:
+        stopped = False
+        while not stopped:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch, stopped = self.collect_batch(first)
+            logger.info("Run detector for batch of %s images", len(batch))
+            try:
+                detections = self.detect_batch([img for img, _ in batch])
+            except Exception as err:  # pylint: disable=broad-except
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+            for (_, future), detection in zip(batch, detections):
+                future.set_result(detection)
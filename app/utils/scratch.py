@@ -0,0 +1,146 @@
+import atexit
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Optional, Type
+
+from app.config import Settings
+from app.utils.logger_configure import configure_logging
+
+settings = Settings()
+
+logger = configure_logging(__file__)
+
+TMPFS_DIR = Path("/dev/shm")
+
+
+class ScratchQuotaExceeded(Exception):
+    pass
+
+
+class Workspace:
+    """Directory for temporary files of one request.
+
+    Bytes written through the workspace are counted against the quota of
+    the scratch space until the workspace is cleaned up.
+    """
+
+    def __init__(self, space: "ScratchSpace", path: Path) -> None:
+        self.space = space
+        self.path = path
+        self.reserved = 0
+        self.closed = False
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.cleanup()
+
+    def directory(self, name: str) -> Path:
+        path = self.path / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def reserve(self, size: int) -> None:
+        """Count size bytes against quota before they are written"""
+
+        self.space.reserve(size)
+        self.reserved += size
+
+    def write_bytes(self, path: Path, data: bytes) -> None:
+        self.reserve(len(data))
+        path.write_bytes(data)
+
+    def cleanup(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.space.release(self.reserved)
+        self.reserved = 0
+
+
+class ScratchSpace:
+    """Used for allocating per-request workspaces with a common byte quota.
+
+    Workspaces are created on tmpfs if it has room for the whole quota,
+    otherwise in the default temporary directory.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        quota_bytes: int,
+        prefer_tmpfs: bool = True,
+    ) -> None:
+        self.quota_bytes = quota_bytes
+        self.base = self.choose_base(directory, quota_bytes, prefer_tmpfs)
+        self.root: Optional[Path] = None
+        self.used_bytes = 0
+        self.workspaces = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def choose_base(
+        directory: Optional[str], quota_bytes: int, prefer_tmpfs: bool
+    ) -> Path:
+        if directory:
+            return Path(directory)
+        if (
+            prefer_tmpfs
+            and TMPFS_DIR.is_dir()
+            and shutil.disk_usage(TMPFS_DIR).free >= quota_bytes
+        ):
+            return TMPFS_DIR
+        return Path(tempfile.gettempdir())
+
+    def workspace(self) -> Workspace:
+        with self.lock:
+            if self.root is None:
+                self.base.mkdir(parents=True, exist_ok=True)
+                self.root = Path(
+                    tempfile.mkdtemp(prefix="scratch-", dir=self.base)
+                )
+                atexit.register(shutil.rmtree, self.root, True)
+                logger.info("Scratch space is created in %s", self.root)
+            self.workspaces += 1
+            path = Path(tempfile.mkdtemp(dir=self.root))
+        return Workspace(self, path)
+
+    def reserve(self, size: int) -> None:
+        with self.lock:
+            if self.used_bytes + size > self.quota_bytes:
+                raise ScratchQuotaExceeded(
+                    f"Scratch space quota {self.quota_bytes} bytes is "
+                    f"exceeded, {self.used_bytes} bytes are in use"
+                )
+            self.used_bytes += size
+
+    def release(self, size: int) -> None:
+        with self.lock:
+            self.used_bytes -= size
+            self.workspaces -= 1
+
+    def usage(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "directory": str(self.root or self.base),
+                "workspaces": self.workspaces,
+                "used_bytes": self.used_bytes,
+                "quota_bytes": self.quota_bytes,
+            }
+
+
+scratch_space = ScratchSpace(
+    directory=settings.scratch_dir,
+    quota_bytes=settings.scratch_quota_bytes,
+    prefer_tmpfs=settings.scratch_prefer_tmpfs,
+)
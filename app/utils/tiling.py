@@ -0,0 +1,218 @@
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from app.utils.images import ImageArray
+
+Tile = Tuple[int, int, int, int]
+Bboxes = npt.NDArray[np.float32]
+
+
+def tile_starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    """Starts of tiles covering length, the last tile ends at the edge"""
+
+    if length <= tile_size:
+        return [0]
+    step = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+
+def split_into_tiles(
+    image: ImageArray, tile_size: int, overlap: int
+) -> Tuple[List[ImageArray], List[Tile]]:
+    """Cut image into overlapping tiles, tiles are views of the image"""
+
+    height, width = image.shape[:2]
+    tiles = []
+    boxes = []
+    for y in tile_starts(height, tile_size, overlap):
+        for x in tile_starts(width, tile_size, overlap):
+            x2, y2 = min(x + tile_size, width), min(y + tile_size, height)
+            tiles.append(image[y:y2, x:x2])
+            boxes.append((x, y, x2, y2))
+    return tiles, boxes
+
+
+def inner_edges_mask(
+    bboxes: Bboxes, tile: Tile, size: Tuple[int, int], margin: int
+) -> npt.NDArray[Any]:
+    """Mask of bboxes which don't touch edges of tile inside the image.
+
+    Bboxes touching an inner edge are usually cut objects, they are
+    merged with pieces from neighbouring tiles.
+    """
+
+    x, y, x2, y2 = tile
+    width, height = size
+    keep = np.ones(len(bboxes), dtype=bool)
+    if x > 0:
+        keep &= bboxes[:, 0] > margin
+    if y > 0:
+        keep &= bboxes[:, 1] > margin
+    if x2 < width:
+        keep &= bboxes[:, 2] < x2 - x - margin
+    if y2 < height:
+        keep &= bboxes[:, 3] < y2 - y - margin
+    return keep
+
+
+def intersections(first: Bboxes, second: Bboxes) -> npt.NDArray[np.float32]:
+    """Intersection widths and heights of every pair of bboxes.
+
+    The result has shape (2, len(first), len(second)), widths and heights
+    are kept in separate planes, so they are contiguous.
+    """
+
+    sides = np.empty((2, len(first), len(second)), np.float32)
+    for axis in (0, 1):
+        np.subtract(
+            np.minimum(first[:, None, axis + 2], second[None, :, axis + 2]),
+            np.maximum(first[:, None, axis], second[None, :, axis]),
+            out=sides[axis],
+        )
+    np.maximum(sides, 0, out=sides)
+    return sides
+
+
+def areas(bboxes: Bboxes) -> npt.NDArray[np.float32]:
+    sides = bboxes[:, 2:4] - bboxes[:, 0:2]
+    result: npt.NDArray[np.float32] = sides[:, 0] * sides[:, 1]
+    return result
+
+
+def nms(bboxes: Bboxes, iou_threshold: float) -> Bboxes:
+    """Keep bboxes with the highest scores among overlapping ones.
+
+    Overlaps of all pairs are computed at once, the greedy pass only
+    combines rows of the kept bboxes.
+    """
+
+    bboxes = bboxes[np.argsort(-bboxes[:, 4], kind="stable")]
+    widths, heights = intersections(bboxes, bboxes)
+    inter = widths * heights
+    union = areas(bboxes)[:, None] + areas(bboxes)[None, :] - inter
+    overlaps = inter > iou_threshold * union
+    keep = np.ones(len(bboxes), dtype=bool)
+    for index in range(len(bboxes)):
+        if keep[index]:
+            keep[index + 1 :] &= ~overlaps[index, index + 1 :]
+    return bboxes[keep]
+
+
+def connected_components(
+    count: int, first: npt.NDArray[Any], second: npt.NDArray[Any]
+) -> npt.NDArray[Any]:
+    """Label of every node is the smallest node of its component.
+
+    Labels are propagated along all edges at once and shortcut through
+    labels of labels until nothing changes.
+    """
+
+    labels: npt.NDArray[Any] = np.arange(count)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, first, labels[second])
+        np.minimum.at(labels, second, labels[first])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def merge_cut_pieces(pieces: Bboxes, iou_threshold: float) -> Bboxes:
+    """Join pieces of objects cut by tile edges into union bboxes.
+
+    Pieces are joined if they intersect and their extents along one of
+    the axes match, which is the case for parts of an object on both
+    sides of a seam. The score of the object is the best score of parts.
+    """
+
+    sides = intersections(pieces, pieces)
+    extents = pieces[:, 2:4] - pieces[:, 0:2]
+    spans = np.stack(
+        [
+            np.maximum(pieces[:, None, axis + 2], pieces[None, :, axis + 2])
+            - np.minimum(pieces[:, None, axis], pieces[None, :, axis])
+            for axis in (0, 1)
+        ]
+    )
+    along = (sides >= iou_threshold * spans).any(axis=0)
+    joined = (sides > 0).all(axis=0) & along
+    valid = (extents[:, 0] > 0) & (extents[:, 1] > 0)
+    joined &= valid[:, None] & valid[None, :]
+    first, second = np.nonzero(np.triu(joined, 1))
+    labels = connected_components(len(pieces), first, second)
+    groups, members = np.unique(labels, return_inverse=True)
+    merged = np.empty((len(groups), 5), np.float32)
+    merged[:, 0:2] = np.inf
+    merged[:, 2:5] = -np.inf
+    np.minimum.at(merged[:, 0:2], members, pieces[:, 0:2])
+    np.maximum.at(merged[:, 2:5], members, pieces[:, 2:5])
+    return merged
+
+
+def merge_class_bboxes(
+    whole: Bboxes, pieces: Bboxes, iou_threshold: float
+) -> Bboxes:
+    """Merge bboxes of one class from all tiles in image coordinates.
+
+    Whole objects found in several tiles are suppressed with NMS. Cut
+    pieces mostly covered by a whole bbox are dropped, the rest are
+    joined into objects which no tile contains whole.
+    """
+
+    whole = nms(whole, iou_threshold)
+    if len(whole) and len(pieces):
+        widths, heights = intersections(pieces, whole)
+        covered = (
+            widths * heights >= iou_threshold * areas(pieces)[:, None]
+        ).any(axis=1)
+        pieces = pieces[~covered]
+    merged = np.concatenate([whole, merge_cut_pieces(pieces, iou_threshold)])
+    return merged[np.argsort(-merged[:, 4], kind="stable")]
+
+
+def merge_tile_detections(
+    detections: Sequence[List[Bboxes]],
+    tiles: Sequence[Tile],
+    size: Tuple[int, int],
+    iou_threshold: float,
+    margin: int = 2,
+) -> List[Bboxes]:
+    """Translate bboxes of tiles to the image and merge them by classes.
+
+    Detections are mmdet results of bbox detectors, one array per class.
+    Objects wider than the overlap of tiles are cut in every tile, their
+    pieces are joined, so they aren't lost at seams.
+    """
+
+    num_classes = len(detections[0])
+    merged = []
+    for label in range(num_classes):
+        whole, pieces = [], []
+        for detection, tile in zip(detections, tiles):
+            offset = np.array(
+                [tile[0], tile[1], tile[0], tile[1], 0], np.float32
+            )
+            class_bboxes = detection[label].astype(np.float32)
+            inner = inner_edges_mask(class_bboxes, tile, size, margin)
+            whole.append(class_bboxes[inner] + offset)
+            pieces.append(class_bboxes[~inner] + offset)
+        merged.append(
+            merge_class_bboxes(
+                np.concatenate(whole).reshape(-1, 5),
+                np.concatenate(pieces).reshape(-1, 5),
+                iou_threshold,
+            )
+        )
+    return merged
+
+
+def needs_tiling(image: Any, tile_size: int) -> bool:
+    return (
+        tile_size > 0
+        and isinstance(image, np.ndarray)
+        and max(image.shape[:2]) > tile_size
+    )
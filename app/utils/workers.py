@@ -0,0 +1,187 @@
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from app.utils.detection import inference_detector_batch
+from app.utils.images import Image
+from app.utils.logger_configure import configure_logging
+from app.utils.metrics import BATCH_SIZE, STAGE_SECONDS
+
+logger = configure_logging(__file__)
+
+Task = Optional[Tuple[int, Sequence[Image]]]
+TaskResult = Tuple[int, Optional[List[Any]], Optional[str], float]
+
+
+class InferenceWorkerFailed(Exception):
+    pass
+
+
+def run_worker(
+    model: Any,
+    tasks: "multiprocessing.Queue[Task]",
+    results: "multiprocessing.Queue[TaskResult]",
+    threads: int,
+) -> None:
+    """Loop of worker process, the model is inherited from the parent.
+
+    Metrics are observed by the parent from the returned timings, the
+    worker never touches the registry inherited by fork.
+    """
+
+    torch.set_num_threads(threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, imgs = task
+        start = time.perf_counter()
+        try:
+            detections = inference_detector_batch(model, imgs, metrics=False)
+        except Exception as err:  # pylint: disable=broad-except
+            results.put((task_id, None, repr(err), 0.0))
+            continue
+        results.put((task_id, detections, None, time.perf_counter() - start))
+
+
+class InferenceWorkers:
+    """Used for running forward passes of one model in worker processes.
+
+    Workers are forked right after the model is loaded. Before that, its
+    weights are moved to shared memory, so every worker uses the same copy
+    instead of holding its own. Each worker has its own number of torch
+    threads, because intra-op parallelism stops scaling after a few cores.
+    A batch is split into chunks for idle workers, and a worker that is
+    free takes the next chunk from the common queue.
+    """
+
+    def __init__(self, model: Any, workers: int, threads: int = 0) -> None:
+        self.context = multiprocessing.get_context("fork")
+        self.model = model
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.tasks: "multiprocessing.Queue[Task]" = self.context.Queue()
+        self.results: "multiprocessing.Queue[TaskResult]" = (
+            self.context.Queue()
+        )
+        self.futures: Dict[int, "Future[List[Any]]"] = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.stopped = False
+        model.share_memory()
+        self.processes = [self.start_worker(index) for index in range(workers)]
+        logger.info(
+            "Started %s inference workers with %s torch threads each",
+            workers,
+            self.threads,
+        )
+        self.collector = threading.Thread(
+            target=self.collect, name="inference-results", daemon=True
+        )
+        self.collector.start()
+
+    def start_worker(self, index: int) -> Any:
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.model, self.tasks, self.results, self.threads),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def submit(self, imgs: Sequence[Image]) -> "Future[List[Any]]":
+        future: "Future[List[Any]]" = Future()
+        with self.lock:
+            if self.stopped:
+                raise InferenceWorkerFailed("Inference workers are stopped")
+            task_id = next(self.ids)
+            self.futures[task_id] = future
+        self.tasks.put((task_id, list(imgs)))
+        return future
+
+    def detect(self, imgs: Sequence[Image]) -> List[Any]:
+        """Split images between workers and wait for all detections"""
+
+        if not imgs:
+            return []
+        chunk_size = math.ceil(len(imgs) / len(self.processes))
+        futures = [
+            self.submit(imgs[start : start + chunk_size])
+            for start in range(0, len(imgs), chunk_size)
+        ]
+        detections: List[Any] = []
+        for future in futures:
+            detections.extend(future.result())
+        return detections
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.futures)
+
+    def collect(self) -> None:
+        """Resolve futures with results sent by worker processes"""
+
+        while not self.stopped:
+            try:
+                task_id, detections, error, seconds = self.results.get(
+                    timeout=1
+                )
+            except queue.Empty:
+                self.check_workers()
+                continue
+            with self.lock:
+                future = self.futures.pop(task_id, None)
+            if future is None:
+                continue
+            if detections is None:
+                future.set_exception(InferenceWorkerFailed(error))
+                continue
+            BATCH_SIZE.observe(len(detections))
+            STAGE_SECONDS.observe(seconds, stage="forward")
+            future.set_result(detections)
+
+    def check_workers(self) -> None:
+        """Replace dead worker processes.
+
+        It isn't known which task a dead worker had taken, so all waiting
+        requests are failed instead of hanging forever.
+        """
+
+        dead = [
+            index
+            for index, process in enumerate(self.processes)
+            if not process.is_alive()
+        ]
+        if not dead or self.stopped:
+            return
+        logger.info("%s inference workers are dead, restart them", len(dead))
+        for index in dead:
+            self.processes[index] = self.start_worker(index)
+        self.fail_pending("Inference worker is dead")
+
+    def fail_pending(self, reason: str) -> None:
+        with self.lock:
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            future.set_exception(InferenceWorkerFailed(reason))
+
+    def stop(self) -> None:
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.fail_pending("Inference workers are stopped")
@@ -0,0 +1,139 @@
+import hashlib
+import shutil
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, NamedTuple, Optional
+
+from minio import Minio
+from minio.error import S3Error
+
+from app.utils.minio import MinioDataLoader
+
+
+class StoredObject(NamedTuple):
+    object_name: str
+    size: int
+    etag: str
+
+
+class FileResponse:
+    """Mimics urllib3 response returned by Minio.get_object"""
+
+    def __init__(self, path: Path) -> None:
+        self.file = path.open("rb")
+
+    def read(self) -> bytes:
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def release_conn(self) -> None:
+        pass
+
+
+class FilesystemBackend(Minio):  # type: ignore
+    """Minio API over a local directory, one subdirectory per bucket.
+
+    It sits under MinioDataLoader in the MRO, so caches, pooling and
+    parallel transfers of the service are measured as in production and
+    only the network calls are replaced.
+    """
+
+    root: Path
+
+    def path(self, bucket: str, name: str) -> Path:
+        return self.root / bucket / name
+
+    def not_found(self, bucket: str, name: str) -> S3Error:
+        return S3Error(
+            "NoSuchKey", "Object does not exist", name, "", "", None, bucket
+        )
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        return (self.root / bucket_name).is_dir()
+
+    def make_bucket(self, bucket_name: str, *args: Any, **kwargs: Any) -> None:
+        (self.root / bucket_name).mkdir(parents=True, exist_ok=True)
+
+    def stat_object(
+        self, bucket_name: str, object_name: str, *args: Any, **kwargs: Any
+    ) -> StoredObject:
+        path = self.path(bucket_name, object_name)
+        if not path.is_file():
+            raise self.not_found(bucket_name, object_name)
+        stat = path.stat()
+        etag = hashlib.md5(
+            f"{stat.st_size}-{stat.st_mtime_ns}".encode()
+        ).hexdigest()
+        return StoredObject(object_name, stat.st_size, etag)
+
+    def list_objects(
+        self,
+        bucket_name: str,
+        prefix: Optional[str] = None,
+        recursive: bool = False,
+        **kwargs: Any,
+    ) -> Iterator[StoredObject]:
+        bucket = self.root / bucket_name
+        pattern = "**/*" if recursive else "*"
+        for path in sorted(bucket.glob(pattern)):
+            name = path.relative_to(bucket).as_posix()
+            if path.is_file() and name.startswith(prefix or ""):
+                yield StoredObject(name, path.stat().st_size, "")
+
+    def get_object(
+        self, bucket_name: str, object_name: str, *args: Any, **kwargs: Any
+    ) -> FileResponse:
+        self.stat_object(bucket_name, object_name)
+        return FileResponse(self.path(bucket_name, object_name))
+
+    def fget_object(
+        self,
+        bucket_name: str,
+        object_name: str,
+        file_path: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        self.stat_object(bucket_name, object_name)
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path(bucket_name, object_name), file_path)
+
+    def put_object(
+        self,
+        bucket_name: str,
+        object_name: str,
+        data: BinaryIO,
+        length: int,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        path = self.path(bucket_name, object_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data.read(length))
+
+    def fput_object(
+        self,
+        bucket_name: str,
+        object_name: str,
+        file_path: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        path = self.path(bucket_name, object_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(file_path, path)
+
+
+class FilesystemMinio(MinioDataLoader, FilesystemBackend):
+    """MinioDataLoader which keeps buckets in a local directory"""
+
+    def __init__(self, root: Path, **kwargs: Any) -> None:
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        super().__init__(
+            endpoint="localhost:9000",
+            access_key="benchmark",
+            secret_key="benchmark",
+            **kwargs,
+        )
@@ -0,0 +1,387 @@
+"""Offline benchmarks of the render -> detect -> extract pipeline.
+
+Run from the root of the repository, no minio or network is needed:
+
+    python -m benchmarks.run --pages 8 --iterations 3 --output bench.json
+
+Settings of the service are read from the environment as usual, so the
+same run can be repeated with e.g. BATCH_SIZE=8 or IN_MEMORY_PIPELINE=true.
+Pass --baseline with a previous output to fail on a throughput regression.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from benchmarks.fake_minio import FilesystemMinio
+from benchmarks.synthetic import make_detection_result, make_pdf
+from benchmarks.tiny_model import CLASSES, write_tiny_model
+
+BUCKET = "benchmark"
+BENCHMARKS = ("extract_boxes_from_result", "render", "predict_for_pdf")
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def configure_environment(workdir: Path) -> None:
+    """Keep caches and scratch files of the service inside workdir.
+
+    The detection cache is turned off: every iteration renders the same
+    pages, so all measured pages would be cache hits without a forward
+    pass. It should be called before app modules are imported, because
+    they read settings on import.
+    """
+
+    os.environ.setdefault("MODEL_CACHE_DIR", str(workdir / "model_cache"))
+    os.environ.setdefault("SCRATCH_DIR", str(workdir / "scratch"))
+    os.environ["RESULT_CACHE_SIZE"] = "0"
+    os.environ.pop("RESULT_CACHE_BUCKET", None)
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(samples, dtype=np.float64)
+    summary = {"mean": float(values.mean()), "max": float(values.max())}
+    for quantile in QUANTILES:
+        summary[f"p{round(quantile * 100)}"] = float(
+            np.quantile(values, quantile)
+        )
+    return summary
+
+
+def snapshot_stages() -> Dict[str, List[int]]:
+    from app.utils.metrics import (  # pylint: disable=import-outside-toplevel
+        STAGE_SECONDS,
+    )
+
+    with STAGE_SECONDS.lock:
+        return {
+            key[0]: list(counts)
+            for key, counts in STAGE_SECONDS.counts.items()
+        }
+
+
+def histogram_quantile(
+    quantile: float, bounds: Sequence[float], counts: Sequence[int]
+) -> float:
+    """Estimate quantile from bucket counts like Prometheus does"""
+
+    rank = quantile * sum(counts)
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(bounds, counts):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return bounds[-1]
+
+
+def stage_quantiles(
+    before: Dict[str, List[int]], after: Dict[str, List[int]]
+) -> Dict[str, Dict[str, float]]:
+    """Latency quantiles of pipeline stages observed between snapshots"""
+
+    from app.utils.metrics import (  # pylint: disable=import-outside-toplevel
+        STAGE_SECONDS,
+    )
+
+    stages = {}
+    for stage, counts in after.items():
+        previous = before.get(stage, [0] * len(counts))
+        delta = [now - was for now, was in zip(counts, previous)]
+        if not sum(delta):
+            continue
+        stages[stage] = {"count": float(sum(delta))}
+        for quantile in QUANTILES:
+            stages[stage][f"p{round(quantile * 100)}"] = histogram_quantile(
+                quantile, STAGE_SECONDS.buckets, delta
+            )
+    return stages
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(
+    run: Callable[[int], int], iterations: int, warmup: int
+) -> Dict[str, Any]:
+    """Call run with the index of iteration, run returns number of pages"""
+
+    for index in range(warmup):
+        run(index)
+    before = snapshot_stages()
+    latencies = []
+    pages = 0
+    start = time.perf_counter()
+    for index in range(warmup, warmup + iterations):
+        call_start = time.perf_counter()
+        pages += run(index)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": iterations,
+        "pages": pages,
+        "seconds": elapsed,
+        "pages_per_second": pages / elapsed,
+        "latency_seconds": summarize(latencies),
+        "stages_seconds": stage_quantiles(before, snapshot_stages()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def upload_documents(
+    client: FilesystemMinio, prefix: str, count: int, pdf: bytes
+) -> List[str]:
+    """Put a copy of pdf for every iteration, so nothing is cached"""
+
+    files = [f"{prefix}/{index}/document.pdf" for index in range(count)]
+    for file in files:
+        client.put_bytes(BUCKET, file, pdf, "application/pdf")
+    return files
+
+
+def bench_extraction(
+    args: argparse.Namespace, output_format: str
+) -> Dict[str, Any]:
+    from app.utils.extraction import (  # pylint: disable=import-outside-toplevel
+        extract_boxes_from_result,
+    )
+
+    width, height = 2550, 3300
+    result = make_detection_result(
+        CLASSES, args.boxes_per_class, (width, height), seed=args.seed
+    )
+
+    def run(_: int) -> int:
+        for page in range(1, args.pages + 1):
+            extract_boxes_from_result(
+                classes=CLASSES,  # type: ignore
+                result=result,
+                size={"width": width, "height": height},
+                page_number=page,
+                document=True,
+                output_format=output_format,
+            )
+        return int(args.pages)
+
+    return measure(run, args.iterations, args.warmup)
+
+
+def bench_render(
+    args: argparse.Namespace, client: FilesystemMinio, pdf: bytes
+) -> Dict[str, Any]:
+    # pylint: disable=import-outside-toplevel
+    from app.utils.rendering import RenderImages, settings
+
+    files = upload_documents(
+        client, "render", args.warmup + args.iterations, pdf
+    )
+    pages = list(range(1, args.pages + 1))
+
+    def run(index: int) -> int:
+        with RenderImages(
+            dpi=settings.dpi,
+            image_format=settings.image_format,
+            minio_client=client,
+            workers=settings.render_workers,
+        ) as render_instance:
+            render_instance.render(BUCKET, files[index], pages)
+        return len(pages)
+
+    return measure(run, args.iterations, args.warmup)
+
+
+def bench_predict(
+    args: argparse.Namespace, client: FilesystemMinio, pdf: bytes
+) -> Dict[str, Any]:
+    # pylint: disable=import-outside-toplevel
+    from app import inference
+    from app.schemas import Args, Predict
+
+    inference.client = client
+    inference.model_cache.client = client
+    config_path, checkpoint_path = write_tiny_model(
+        Path(args.workdir) / "model",
+        (args.img_scale[0], args.img_scale[1]),
+        seed=args.seed,
+    )
+    client.fput_object(BUCKET, "model/tiny_detector.py", str(config_path))
+    client.fput_object(BUCKET, "model/tiny_detector.pth", str(checkpoint_path))
+    service = inference.InferenceService(
+        "benchmark",
+        BUCKET,
+        "model/tiny_detector.pth",
+        BUCKET,
+        "model/tiny_detector.py",
+        "cpu",
+    )
+    files = upload_documents(
+        client, "predict", args.warmup + args.iterations, pdf
+    )
+    pages = list(range(1, args.pages + 1))
+
+    def run(index: int) -> int:
+        service.predict_for_pdf(
+            Predict(
+                input_path="",
+                input={},
+                file=files[index],
+                bucket=BUCKET,
+                pages=pages,
+                output_path=f"results/{index}.json",
+                output_bucket=BUCKET,
+                args=Args(verbose=False),
+            )
+        )
+        return len(pages)
+
+    try:
+        return measure(run, args.iterations, args.warmup)
+    finally:
+        service.remove_model("benchmark")
+
+
+def environment() -> Dict[str, Any]:
+    from app.config import Settings  # pylint: disable=import-outside-toplevel
+
+    settings = Settings()
+    info: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            name: getattr(settings, name)
+            for name in (
+                "dpi",
+                "image_format",
+                "batch_size",
+                "in_memory_pipeline",
+                "render_workers",
+                "scheduler_enabled",
+                "minio_transfer_workers",
+            )
+        },
+    }
+    try:
+        import torch  # pylint: disable=import-outside-toplevel
+
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def regressions(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Benchmarks with throughput lower than baseline beyond tolerance"""
+
+    slower = []
+    for name, result in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous:
+            continue
+        ratio = result["pages_per_second"] / previous["pages_per_second"]
+        if ratio < 1 - tolerance:
+            slower.append(f"{name}: {ratio:.2f} of baseline pages/sec")
+    return slower
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--lines-per-page", type=int, default=30)
+    parser.add_argument("--boxes-per-class", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--img-scale",
+        type=int,
+        nargs=2,
+        default=(1333, 800),
+        help="Test scale of the tiny detector, like in mmdet configs",
+    )
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS
+    )
+    parser.add_argument("--workdir", help="Keep files here instead of tmp")
+    parser.add_argument("--output", help="Json file, stdout by default")
+    parser.add_argument("--baseline", help="Json output of a previous run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed drop of pages/sec against baseline",
+    )
+    parser.add_argument(
+        "--log", action="store_true", help="Keep logs of the service"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as tmp:
+        args.workdir = args.workdir or tmp
+        workdir = Path(args.workdir)
+        configure_environment(workdir)
+        if not args.log:
+            logging.disable(logging.INFO)
+
+        client = FilesystemMinio(workdir / "minio", metadata_ttl=60)
+        client.make_bucket(BUCKET)
+        pdf = make_pdf(args.pages, args.lines_per_page, seed=args.seed)
+
+        results: Dict[str, Any] = {
+            "environment": environment(),
+            "parameters": {
+                "pages": args.pages,
+                "lines_per_page": args.lines_per_page,
+                "boxes_per_class": args.boxes_per_class,
+                "iterations": args.iterations,
+                "warmup": args.warmup,
+                "img_scale": list(args.img_scale),
+            },
+            "benchmarks": {},
+        }
+        # from the lightest to the heaviest, because peak rss only grows
+        benchmarks = results["benchmarks"]
+        if "extract_boxes_from_result" in args.benchmarks:
+            for output_format in ("objects", "columnar"):
+                benchmarks[
+                    f"extract_boxes_from_result[{output_format}]"
+                ] = bench_extraction(args, output_format)
+        if "render" in args.benchmarks:
+            benchmarks["render"] = bench_render(args, client, pdf)
+        if "predict_for_pdf" in args.benchmarks:
+            benchmarks["predict_for_pdf"] = bench_predict(args, client, pdf)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        slower = regressions(results, baseline, args.tolerance)
+        for message in slower:
+            print(f"Regression: {message}", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import random
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+FORMULAS = (
+    "E = mc^2",
+    "a^2 + b^2 = c^2",
+    "f(x) = sum_{n=0}^{inf} x^n / n!",
+    "int_0^1 x^2 dx = 1/3",
+    "lim_{x -> 0} sin(x) / x = 1",
+    "e^{i pi} + 1 = 0",
+    "d/dx [ln x] = 1/x",
+    "P(A|B) = P(B|A) P(A) / P(B)",
+)
+
+WORDS = (
+    "the model detects formulas on rendered pages of scientific documents "
+    "with inline and display math"
+).split()
+
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_content(rng: random.Random, lines: int) -> bytes:
+    """Draw paragraphs of text with display formulas under fraction bars"""
+
+    commands = []
+    y = PAGE_HEIGHT - 72
+    step = (PAGE_HEIGHT - 144) // lines
+    for _ in range(lines):
+        if rng.random() < 0.3:
+            formula = rng.choice(FORMULAS)
+            x = 72 + rng.randint(60, 160)
+            commands.append(
+                f"BT /F2 14 Tf {x} {y} Td ({escape(formula)}) Tj ET"
+            )
+            commands.append(f"{x} {y - 4} {8 * len(formula)} 0.8 re f")
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(12))
+            formula = rng.choice(FORMULAS)
+            commands.append(
+                f"BT /F1 11 Tf 72 {y} Td ({escape(text)} ) Tj "
+                f"/F2 11 Tf ({escape(formula)}) Tj ET"
+            )
+        y -= step
+    return "\n".join(commands).encode()
+
+
+def make_pdf(pages: int, lines_per_page: int = 30, seed: int = 0) -> bytes:
+    """Write multi-page pdf with text and formulas without any pdf library"""
+
+    rng = random.Random(seed)
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Times-Italic >>",
+    ]
+    kids = []
+    for _ in range(pages):
+        content = page_content(rng, lines_per_page)
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream"
+            % (len(content), content)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+            b"/Contents %d 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(kids),
+        pages,
+    )
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return bytes(pdf)
+
+
+def make_detection_result(
+    classes: Sequence[str],
+    boxes_per_class: int,
+    size: Tuple[int, int],
+    seed: int = 0,
+) -> List[Any]:
+    """Random detector output in the mmdet format: one array per class"""
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    result = []
+    for _ in classes:
+        x1 = rng.uniform(0, width * 0.9, boxes_per_class)
+        y1 = rng.uniform(0, height * 0.9, boxes_per_class)
+        x2 = x1 + rng.uniform(10, width * 0.1, boxes_per_class)
+        y2 = y1 + rng.uniform(10, height * 0.1, boxes_per_class)
+        scores = rng.uniform(0, 1, boxes_per_class)
+        result.append(
+            np.stack([x1, y1, x2, y2, scores], axis=1).astype(np.float32)
+        )
+    return result
@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import Tuple
+
+CLASSES = ("formula", "inline_formula", "equation_number")
+
+CONFIG = """\
+model = dict(
+    type="RetinaNet",
+    pretrained=None,
+    backbone=dict(
+        type="ResNet",
+        depth=18,
+        num_stages=4,
+        out_indices=(0, 1, 2, 3),
+        frozen_stages=-1,
+        norm_cfg=dict(type="BN", requires_grad=False),
+        norm_eval=True,
+        style="pytorch",
+    ),
+    neck=dict(
+        type="FPN",
+        in_channels=[64, 128, 256, 512],
+        out_channels=32,
+        start_level=1,
+        add_extra_convs="on_input",
+        num_outs=5,
+    ),
+    bbox_head=dict(
+        type="RetinaHead",
+        num_classes={num_classes},
+        in_channels=32,
+        stacked_convs=1,
+        feat_channels=32,
+        anchor_generator=dict(
+            type="AnchorGenerator",
+            octave_base_scale=4,
+            scales_per_octave=3,
+            ratios=[0.5, 1.0, 2.0],
+            strides=[8, 16, 32, 64, 128],
+        ),
+        bbox_coder=dict(
+            type="DeltaXYWHBBoxCoder",
+            target_means=[0.0, 0.0, 0.0, 0.0],
+            target_stds=[1.0, 1.0, 1.0, 1.0],
+        ),
+        loss_cls=dict(
+            type="FocalLoss",
+            use_sigmoid=True,
+            gamma=2.0,
+            alpha=0.25,
+            loss_weight=1.0,
+        ),
+        loss_bbox=dict(type="L1Loss", loss_weight=1.0),
+    ),
+)
+test_cfg = dict(
+    nms_pre=1000,
+    min_bbox_size=0,
+    score_thr=0.05,
+    nms=dict(type="nms", iou_threshold=0.5),
+    max_per_img=100,
+)
+img_norm_cfg = dict(
+    mean=[123.675, 116.28, 103.53], std=[58.395, 57.12, 57.375], to_rgb=True
+)
+test_pipeline = [
+    dict(type="LoadImageFromFile"),
+    dict(
+        type="MultiScaleFlipAug",
+        img_scale={img_scale},
+        flip=False,
+        transforms=[
+            dict(type="Resize", keep_ratio=True),
+            dict(type="RandomFlip"),
+            dict(type="Normalize", **img_norm_cfg),
+            dict(type="Pad", size_divisor=32),
+            dict(type="ImageToTensor", keys=["img"]),
+            dict(type="Collect", keys=["img"]),
+        ],
+    ),
+]
+data = dict(
+    samples_per_gpu=1,
+    workers_per_gpu=0,
+    test=dict(
+        type="CocoDataset",
+        classes={classes},
+        ann_file="",
+        img_prefix="",
+        pipeline=test_pipeline,
+    ),
+)
+"""
+
+
+def write_tiny_model(
+    directory: Path, img_scale: Tuple[int, int] = (1333, 800), seed: int = 0
+) -> Tuple[Path, Path]:
+    """Write config and checkpoint of a small randomly initialised detector.
+
+    Its weights are random, so boxes are meaningless, but the forward pass
+    goes through the same mmdet pipeline as the real latex detector.
+    """
+
+    import torch  # pylint: disable=import-outside-toplevel
+    from mmcv import Config  # pylint: disable=import-outside-toplevel
+    from mmdet.models import (  # pylint: disable=import-outside-toplevel
+        build_detector,
+    )
+
+    directory.mkdir(parents=True, exist_ok=True)
+    config_path = directory / "tiny_detector.py"
+    checkpoint_path = directory / "tiny_detector.pth"
+    config_path.write_text(
+        CONFIG.format(
+            num_classes=len(CLASSES), img_scale=img_scale, classes=CLASSES
+        )
+    )
+    torch.manual_seed(seed)
+    config = Config.fromfile(str(config_path))
+    model = build_detector(config.model, test_cfg=config.test_cfg)
+    model.init_weights()
+    torch.save(
+        {"meta": {"CLASSES": CLASSES}, "state_dict": model.state_dict()},
+        str(checkpoint_path),
+    )
+    return config_path, checkpoint_path
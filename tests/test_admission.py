@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.admission import AdmissionControl, AdmissionRejected
+
+
+def test_work_within_budget_is_admitted():
+    admission = AdmissionControl(max_pages=4, max_bytes=100, timeout=0.1)
+
+    admission.acquire(2, 50)
+    admission.acquire(2, 50)
+
+    assert admission.usage() == {("pages",): 4, ("bytes",): 100}
+
+
+@pytest.mark.parametrize("pages, size", [(1, 0), (0, 1)])
+def test_work_over_budget_is_rejected_after_timeout(pages, size):
+    admission = AdmissionControl(max_pages=4, max_bytes=100, timeout=0.05)
+    admission.acquire(4, 100)
+
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(pages, size)
+
+    assert time.monotonic() - start >= 0.05
+    assert admission.usage() == {("pages",): 4, ("bytes",): 100}
+
+
+def test_waiting_work_is_admitted_when_pages_are_released():
+    admission = AdmissionControl(max_pages=2, max_bytes=0, timeout=5)
+    admission.acquire(2, 0)
+    admitted = threading.Event()
+
+    def wait() -> None:
+        with admission.admit(1, 0):
+            admitted.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    assert not admitted.wait(0.05)
+    admission.release(2, 0)
+    thread.join(1)
+
+    assert admitted.is_set()
+    assert admission.usage() == {("pages",): 0, ("bytes",): 0}
+
+
+def test_work_bigger_than_budget_is_admitted_alone():
+    admission = AdmissionControl(max_pages=2, max_bytes=10, timeout=0.01)
+
+    with admission.admit(5, 1000):
+        with pytest.raises(AdmissionRejected):
+            admission.acquire(1, 1)
+
+    assert admission.usage() == {("pages",): 0, ("bytes",): 0}
+
+
+def test_zero_limits_are_not_checked():
+    admission = AdmissionControl(max_pages=0, max_bytes=0, timeout=0.01)
+
+    admission.acquire(1000, 10**12)
+    admission.acquire(1000, 10**12)
+
+    assert admission.usage()[("pages",)] == 2000
+
+
+def test_pages_are_released_when_block_fails():
+    admission = AdmissionControl(max_pages=1, max_bytes=0, timeout=0.01)
+
+    with pytest.raises(ValueError):
+        with admission.admit(1, 0):
+            raise ValueError
+
+    admission.acquire(1, 0)
+
+
+def test_lease_releases_pages_one_by_one_and_rest_on_close():
+    admission = AdmissionControl(max_pages=4, max_bytes=0, timeout=0.01)
+
+    with admission.lease() as lease:
+        lease.acquire(3, 30)
+        lease.release(1, 10)
+        assert admission.usage() == {("pages",): 2, ("bytes",): 20}
+
+    assert admission.usage() == {("pages",): 0, ("bytes",): 0}
+
+
+def test_pages_held_by_lease_do_not_block_oversized_window():
+    admission = AdmissionControl(max_pages=2, max_bytes=0, timeout=0.01)
+
+    with admission.lease() as lease:
+        lease.acquire(2, 0)
+        lease.acquire(3, 0)
+        with pytest.raises(AdmissionRejected):
+            admission.acquire(1, 0)
+
+    assert admission.usage()[("pages",)] == 0
+
+
+def test_lease_does_not_release_more_than_it_holds():
+    admission = AdmissionControl(max_pages=4, max_bytes=0, timeout=0.01)
+    admission.acquire(1, 0)
+
+    with admission.lease() as lease:
+        lease.acquire(1, 0)
+        lease.release(5, 0)
+
+    assert admission.usage()[("pages",)] == 1
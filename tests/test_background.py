@@ -0,0 +1,29 @@
+import threading
+
+from app.utils.background import BoundedExecutor
+
+
+def test_task_over_queue_is_dropped():
+    executor = BoundedExecutor(workers=1, max_pending=1, name="test")
+    started = threading.Event()
+
+    assert executor.submit(started.wait)
+    assert not executor.submit(print)
+    started.set()
+    executor.executor.shutdown()
+
+
+def test_blocking_queue_waits_for_free_slot():
+    executor = BoundedExecutor(
+        workers=1, max_pending=1, name="test", blocking=True
+    )
+    gate = threading.Event()
+    done = []
+    threading.Timer(0.05, gate.set).start()
+
+    assert executor.submit(gate.wait)
+    assert executor.submit(done.append, 1)
+    executor.executor.shutdown()
+
+    assert gate.is_set()
+    assert done == [1]
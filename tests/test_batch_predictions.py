@@ -0,0 +1,168 @@
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app import inference
+from app.inference import InferenceService
+from app.schemas import Predict
+from app.utils.admission import AdmissionControl
+
+
+def encode_pdf(pages):
+    buffer = io.BytesIO()
+    images = [Image.new("RGB", (100, 100), "white") for _ in range(pages)]
+    images[0].save(
+        buffer, format="PDF", save_all=True, append_images=images[1:]
+    )
+    return buffer.getvalue()
+
+
+class Stat:
+    def __init__(self, size):
+        self.size = size
+
+
+def encode_png(width, height):
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8)).save(
+        buffer, format="PNG"
+    )
+    return buffer.getvalue()
+
+
+class Client:
+    def __init__(self, objects):
+        self.objects = objects
+        self.results = {}
+        self.transfer_executor = ThreadPoolExecutor(max_workers=2)
+
+    def bucket_exists(self, bucket):
+        return True
+
+    def get_bytes(self, bucket, path):
+        return self.objects[path]
+
+    def put_bytes(self, bucket, path, data, content_type):
+        self.results[path] = json.loads(data)
+
+    def list_object_names(self, bucket, prefix):
+        return set()
+
+    def stat_object(self, bucket, path):
+        return Stat(len(self.objects[path]))
+
+    def fget_object(self, bucket, path, file_path):
+        with open(file_path, "wb") as file:
+            file.write(self.objects[path])
+
+
+class Model:
+    CLASSES = ("formula",)
+
+
+@pytest.fixture
+def service():
+    service = InferenceService.__new__(InferenceService)
+    service.__dict__.update(
+        name="model",
+        lock=threading.Lock(),
+        in_flight=0,
+        retired=False,
+        closed=False,
+        checkpoint_etag="",
+        backend="pytorch",
+        model=Model(),
+        detected=[],
+    )
+
+    def detect(imgs):
+        service.detected.append([img.shape for img in imgs])
+        return [[np.array([[1, 2, 3, 4, 0.9]])] for _ in imgs]
+
+    service.detect = detect
+    return service
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = Client(
+        {
+            "img/x.png": encode_png(40, 30),
+            "img/y.png": encode_png(20, 10),
+            "img/bad.png": encode_png(20, 10)[:40],
+            "doc/a.pdf": encode_pdf(3),
+            "doc/b.pdf": encode_pdf(3),
+        }
+    )
+    monkeypatch.setattr(inference, "client", client)
+    monkeypatch.setattr(inference.detection_cache, "enabled", False)
+    yield client
+    client.transfer_executor.shutdown()
+
+
+def request(file, pages=None):
+    return Predict(
+        input_path="runs/1",
+        input={},
+        file=file,
+        bucket="bucket",
+        pages=pages,
+        output_path=f"out/{file}.json",
+        args={"verbose": False},
+    )
+
+
+def test_broken_image_fails_only_its_own_item(service, client):
+    files = ["img/x.png", "img/bad.png", "img/missing.png", "img/y.png"]
+
+    statuses = service.predict_batch([request(file) for file in files])
+
+    assert [status["status"] for status in statuses] == [
+        "done",
+        "failed",
+        "failed",
+        "done",
+    ]
+    assert "can't be decoded" in statuses[1]["detail"]
+    assert "missing.png" in statuses[2]["detail"]
+    assert service.detected == [[(30, 40, 3), (10, 20, 3)]]
+    [page] = client.results["out/img/x.png.json"]["pages"]
+    assert page["size"] == {"width": 40, "height": 30}
+    assert "out/img/bad.png.json" not in client.results
+
+
+def test_pages_are_in_budget_until_their_batch_is_detected(
+    monkeypatch, service, client
+):
+    admission = AdmissionControl(max_pages=8, max_bytes=0, timeout=0.01)
+    monkeypatch.setattr(inference, "admission", admission)
+    for name, value in [
+        ("batch_size", 2),
+        ("pages_in_flight", 2),
+        ("dpi", 72),
+        ("in_memory_pipeline", True),
+        ("cache_rendered_images", False),
+        ("render_workers", 1),
+    ]:
+        monkeypatch.setattr(inference.settings, name, value)
+    in_flight = []
+    detect = service.detect
+
+    def count_pages(imgs):
+        in_flight.append(admission.usage()[("pages",)])
+        return detect(imgs)
+
+    service.detect = count_pages
+
+    statuses = service.predict_batch(
+        [request("doc/a.pdf", [1, 2, 3]), request("doc/b.pdf", [1, 2, 3])]
+    )
+
+    assert [status["status"] for status in statuses] == ["done", "done"]
+    assert in_flight == [2, 3, 2]
+    assert admission.usage()[("pages",)] == 0
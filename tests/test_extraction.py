@@ -0,0 +1,123 @@
+import re
+import uuid
+
+import numpy as np
+import pytest
+
+from app.config import Settings
+from app.utils.extraction import (
+    COLUMNAR_FORMAT,
+    extract_boxes_from_result,
+    generate_ids,
+    prepare_response,
+)
+
+settings = Settings()
+
+CLASSES = ("formula", "inline", "table")
+UUID4 = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$"
+)
+
+
+def extract_with_loop(classes, result, score_thr, document):
+    """Extraction as it was done before vectorization, without ids"""
+
+    objs = []
+    for label, bboxes in enumerate(result):
+        for bbox in bboxes:
+            if bbox[-1] <= score_thr:
+                continue
+            if document:
+                coords = [
+                    i * settings.inch_to_point / settings.dpi
+                    for i in bbox.astype(np.int32)[:4]
+                ]
+            else:
+                coords = [float(i) for i in bbox.astype(np.int32)[:4]]
+            objs.append({"bbox": coords, "category": classes[label]})
+    return objs
+
+
+@pytest.fixture
+def result():
+    rng = np.random.default_rng(0)
+    bboxes = []
+    for count in (5, 0, 7):
+        corners = rng.uniform(0, 2000, (count, 2))
+        sides = rng.uniform(1, 300, (count, 2))
+        scores = rng.uniform(0, 1, (count, 1))
+        bboxes.append(
+            np.hstack([corners, corners + sides, scores]).astype(np.float32)
+        )
+    return bboxes
+
+
+def test_generated_ids_are_unique_uuid4():
+    ids = generate_ids(1000)
+
+    assert len(set(ids)) == 1000
+    assert all(UUID4.match(id) for id in ids)
+    assert all(uuid.UUID(id).version == 4 for id in ids)
+
+
+def test_no_ids_are_generated_for_empty_page():
+    assert generate_ids(0) == []
+
+
+@pytest.mark.parametrize("document", [False, True])
+def test_extraction_matches_loop(result, document):
+    output = extract_boxes_from_result(
+        CLASSES,
+        result,
+        {"width": 10, "height": 10},
+        page_number=3,
+        score_thr=0.3,
+        document=document,
+    )
+
+    assert output["page_num"] == 3
+    assert [
+        {"bbox": obj["bbox"], "category": obj["category"]}
+        for obj in output["objs"]
+    ] == extract_with_loop(CLASSES, result, 0.3, document)
+
+
+def test_columnar_format_has_same_objects(result):
+    output = extract_boxes_from_result(
+        CLASSES,
+        result,
+        {"width": 10, "height": 10},
+        score_thr=0.3,
+        output_format=COLUMNAR_FORMAT,
+    )
+    objs = extract_with_loop(CLASSES, result, 0.3, False)
+
+    assert output["bboxes"] == [obj["bbox"] for obj in objs]
+    assert output["categories"] == [obj["category"] for obj in objs]
+    assert len(output["ids"]) == len(output["scores"]) == len(objs)
+
+
+def test_response_groups_ids_by_category_and_page(result):
+    pages = [
+        extract_boxes_from_result(
+            CLASSES, result, {}, page_number=page, score_thr=0.3
+        )
+        for page in (1, 2)
+    ]
+    columnar = extract_boxes_from_result(
+        CLASSES,
+        result,
+        {},
+        page_number=3,
+        score_thr=0.3,
+        output_format=COLUMNAR_FORMAT,
+    )
+
+    response = prepare_response(pages + [columnar])
+
+    for page in pages:
+        for obj in page["objs"]:
+            assert obj["id"] in response[obj["category"]][page["page_num"]]
+    for id, category in zip(columnar["ids"], columnar["categories"]):
+        assert id in response[category][3]
@@ -0,0 +1,68 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils.images import decode_image, probe_image_size
+
+
+def encode(image, image_format, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image():
+    return Image.fromarray(np.zeros((37, 53, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "JPEG"])
+def test_size_is_read_from_header(image, image_format):
+    data = encode(image, image_format)
+
+    assert probe_image_size(data) == (53, 37)
+    assert decode_image(data).shape == (37, 53, 3)
+
+
+def test_progressive_jpeg_size_is_read_from_header(image):
+    data = encode(image, "JPEG", progressive=True)
+
+    assert probe_image_size(data) == (53, 37)
+
+
+def test_jpeg_with_exif_falls_back_to_decoding(image):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    data = encode(image, "JPEG", exif=exif.tobytes())
+
+    assert probe_image_size(data) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"GIF89a\x00\x00", b"\xff\xd8\xff\xc0\x00", b"\x89PNG\r\n\x1a\n"],
+)
+def test_unknown_or_truncated_data_is_not_probed(data):
+    assert probe_image_size(data) is None
+
+
+def test_truncated_jpeg_is_not_probed(image):
+    data = encode(image, "JPEG")
+
+    assert probe_image_size(data[:20]) is None
+
+
+@pytest.mark.parametrize("length", [16, 20, 23])
+def test_png_truncated_in_header_is_not_probed(image, length):
+    data = encode(image, "PNG")
+
+    assert probe_image_size(data[:length]) is None
+
+
+def test_undecodable_image_is_rejected(image):
+    data = encode(image, "PNG")
+
+    with pytest.raises(ValueError, match="can't be decoded"):
+        decode_image(data[:40])
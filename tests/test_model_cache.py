@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from app.utils.model_cache import ModelCache
+
+
+class Stat:
+    def __init__(self, etag):
+        self.etag = etag
+
+
+class Client:
+    def __init__(self, objects):
+        self.objects = objects
+        self.downloads = []
+
+    def stat_object(self, bucket, file):
+        return Stat(self.objects[file][0])
+
+    def fget_object(self, bucket, file, path):
+        self.downloads.append(file)
+        with open(path, "wb") as output:
+            output.write(self.objects[file][1][:5])
+            if file == "broken.pth":
+                raise ConnectionError("Connection is reset")
+            output.write(self.objects[file][1][5:])
+
+
+@pytest.fixture
+def client():
+    return Client({name: ("v1", b"x" * 10) for name in ("a.pth", "b.pth")})
+
+
+def get(cache, file, mtime=None):
+    cached = cache.get("models", file)
+    if mtime is not None:
+        os.utime(cached.path.parent, (mtime, mtime))
+    return cached
+
+
+def test_unchanged_object_is_not_downloaded_again(tmp_path, client):
+    cache = ModelCache(client, tmp_path, max_bytes=100)
+
+    first = get(cache, "a.pth")
+    second = get(cache, "a.pth")
+
+    assert second == first
+    assert second.path.read_bytes() == b"x" * 10
+    assert client.downloads == ["a.pth"]
+
+
+def test_changed_etag_is_downloaded_again(tmp_path, client):
+    cache = ModelCache(client, tmp_path, max_bytes=100)
+    first = get(cache, "a.pth")
+
+    client.objects["a.pth"] = ("v2", b"y" * 10)
+    second = get(cache, "a.pth")
+
+    assert second.etag == "v2"
+    assert second.path != first.path
+    assert second.path.read_bytes() == b"y" * 10
+    assert client.downloads == ["a.pth", "a.pth"]
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, client):
+    client.objects["c.pth"] = ("v1", b"x" * 10)
+    cache = ModelCache(client, tmp_path, max_bytes=25)
+    a = get(cache, "a.pth", mtime=1)
+    b = get(cache, "b.pth", mtime=2)
+    get(cache, "a.pth")
+
+    c = get(cache, "c.pth")
+
+    assert a.path.exists()
+    assert not b.path.parent.exists()
+    assert c.path.exists()
+    assert cache.size() == 20
+
+
+def test_new_entry_is_kept_even_if_it_is_over_limit(tmp_path, client):
+    cache = ModelCache(client, tmp_path, max_bytes=5)
+    a = get(cache, "a.pth", mtime=1)
+
+    b = get(cache, "b.pth")
+
+    assert not a.path.exists()
+    assert b.path.exists()
+
+
+def test_failed_download_leaves_no_temporary_entry(tmp_path, client):
+    cache = ModelCache(client, tmp_path, max_bytes=100)
+    client.objects["broken.pth"] = ("v1", b"x" * 10)
+
+    with pytest.raises(ConnectionError):
+        get(cache, "broken.pth")
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from app.inference import InferenceService, ModelIsUnloaded
+
+
+def make_service(name):
+    service = InferenceService.__new__(InferenceService)
+    service.__dict__.update(
+        name=name,
+        ready=True,
+        lock=threading.Lock(),
+        in_flight=0,
+        retired=False,
+        closed=False,
+        checkpoint_etag="",
+        scheduler=None,
+        workers=None,
+        model=object(),
+    )
+    return service
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    yield
+    InferenceService.models.clear()
+
+
+def test_swap_during_request_keeps_old_version_open():
+    old, new = make_service("model"), make_service("model")
+    InferenceService.add_model("model", old)
+
+    with InferenceService.acquire("model") as model:
+        InferenceService.add_model("model", new)
+        assert model is old
+        assert not old.closed
+        with old.track_request():
+            pass
+
+    assert old.closed
+    assert not new.closed
+
+
+def test_acquire_not_existing_model_yields_none():
+    with InferenceService.acquire("missing") as model:
+        assert model is None
+
+
+def test_closed_model_rejects_requests():
+    service = make_service("model")
+    InferenceService.add_model("model", service)
+    InferenceService.remove_model("model")
+
+    with pytest.raises(ModelIsUnloaded):
+        with service.track_request():
+            pass
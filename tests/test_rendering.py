@@ -0,0 +1,138 @@
+import shutil
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.utils import rendering
+from app.utils.documents import PdfDocument
+from app.utils.rendering import RenderImages
+from app.utils.scratch import scratch_space
+
+
+class Stat:
+    def __init__(self, size):
+        self.size = size
+
+
+class Client:
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.objects = {}
+
+    def list_object_names(self, bucket, prefix):
+        return set(self.objects)
+
+    def add_object_names(self, bucket, prefix, names):
+        pass
+
+    def stat_object(self, bucket, file):
+        return Stat(self.pdf.stat().st_size)
+
+    def fget_object(self, bucket, file, path):
+        shutil.copy(self.pdf, path)
+
+    def put_bytes(self, bucket, name, data, content_type):
+        self.objects[name] = data
+
+
+@pytest.fixture
+def client(tmp_path):
+    gradient = np.tile(np.arange(256, dtype=np.uint8), (300, 1))
+    pdf = tmp_path / "doc.pdf"
+    Image.fromarray(gradient).convert("RGB").save(pdf)
+    return Client(pdf)
+
+
+def render(client, cache):
+    with RenderImages(
+        dpi=100, image_format="png", minio_client=client
+    ) as render_instance:
+        [(name, image)] = render_instance.render_to_arrays(
+            bucket="bucket",
+            file="d/doc.pdf",
+            pages=[1],
+            cache=cache,
+            resolutions={1: 61},
+        )
+    return name, image
+
+
+def test_cached_page_has_same_pixels_as_missing_one(client):
+    name, missing = render(client, cache=True)
+    client.objects[name] = b""
+
+    _, cached = render(client, cache=True)
+
+    assert name == "d/images_100/1.png"
+    assert np.array_equal(cached, missing)
+
+
+def test_page_is_rendered_in_detection_resolution_without_cache(client):
+    _, image = render(client, cache=False)
+
+    assert image.shape == (255, 217, 3)
+
+
+class Pool:
+    """Pool rendering in this process, it breaks after broken chunks"""
+
+    def __init__(self, broken=None):
+        self.broken = broken
+        self.chunks = []
+
+    def map(self, fn, *iterables):
+        for args in zip(*iterables):
+            if len(self.chunks) == self.broken:
+                raise BrokenProcessPool("worker is killed")
+            self.chunks.append([page for page, _ in args[1]])
+            yield fn(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@pytest.fixture
+def document(tmp_path):
+    pages = [Image.new("RGB", (100 + 10 * i, 100), "white") for i in range(3)]
+    pdf = tmp_path / "pages.pdf"
+    pages[0].save(pdf, save_all=True, append_images=pages[1:])
+    workspace = scratch_space.workspace()
+    document = PdfDocument(Client(pdf), "bucket", "pages.pdf", workspace)
+    yield document
+    document.close()
+    workspace.cleanup()
+
+
+def render_in_workers(monkeypatch, document, pools):
+    created = list(pools)
+    monkeypatch.setattr(rendering, "render_executor", None)
+    monkeypatch.setattr(
+        rendering, "ProcessPoolExecutor", lambda max_workers: pools.pop(0)
+    )
+    render_instance = RenderImages(
+        dpi=72, image_format="png", minio_client=None, workers=3
+    )
+    rendered = render_instance.render_in_workers(document, [1, 2, 3])
+    return created, [page for page, _, _ in rendered]
+
+
+def test_broken_render_pool_is_replaced(monkeypatch, document):
+    (broken, pool), pages = render_in_workers(
+        monkeypatch, document, [Pool(broken=1), Pool()]
+    )
+
+    assert pages == [1, 2, 3]
+    assert broken.chunks == [[1]]
+    assert pool.chunks == [[2], [3]]
+    assert rendering.render_executor is pool
+
+
+def test_render_pool_is_replaced_only_once(monkeypatch, document):
+    with pytest.raises(BrokenProcessPool):
+        render_in_workers(
+            monkeypatch, document, [Pool(broken=0), Pool(broken=0)]
+        )
+
+    assert rendering.render_executor is None
@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.utils.scheduler import BatchScheduler
+
+
+class Detector:
+    def __init__(self, fail: bool = False) -> None:
+        self.batches = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, imgs):
+        with self.lock:
+            self.batches.append(list(imgs))
+        if self.fail:
+            raise RuntimeError("forward is failed")
+        return [f"detection of {img}" for img in imgs]
+
+
+@pytest.fixture
+def detector():
+    return Detector()
+
+
+def test_detections_are_returned_in_order(detector):
+    scheduler = BatchScheduler(detector, max_batch_size=8, max_wait=0.05)
+
+    assert scheduler.detect(["a", "b", "c"]) == [
+        "detection of a",
+        "detection of b",
+        "detection of c",
+    ]
+    scheduler.stop()
+
+
+def test_images_of_concurrent_requests_share_batches(detector):
+    scheduler = BatchScheduler(detector, max_batch_size=4, max_wait=0.2)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(lambda img: scheduler.detect([img]), "abcd")
+        )
+
+    assert results == [[f"detection of {img}"] for img in "abcd"]
+    assert len(detector.batches) < 4
+    assert max(len(batch) for batch in detector.batches) <= 4
+    scheduler.stop()
+
+
+def test_batch_is_limited_by_max_batch_size(detector):
+    scheduler = BatchScheduler(detector, max_batch_size=2, max_wait=0.2)
+
+    scheduler.detect(["a", "b", "c", "d", "e"])
+
+    assert [len(batch) for batch in detector.batches] == [2, 2, 1]
+    scheduler.stop()
+
+
+def test_error_of_detector_is_raised_for_every_image():
+    scheduler = BatchScheduler(
+        Detector(fail=True), max_batch_size=4, max_wait=0.01
+    )
+
+    futures = [scheduler.submit(img) for img in "ab"]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="forward is failed"):
+            future.result(timeout=1)
+    scheduler.stop()
+
+
+def test_scheduler_keeps_working_after_failed_batch():
+    detector = Detector(fail=True)
+    scheduler = BatchScheduler(detector, max_batch_size=4, max_wait=0.01)
+    with pytest.raises(RuntimeError):
+        scheduler.detect(["a"])
+
+    detector.fail = False
+
+    assert scheduler.detect(["b"]) == ["detection of b"]
+    scheduler.stop()
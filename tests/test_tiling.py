@@ -0,0 +1,125 @@
+import numpy as np
+
+from app.utils.tiling import (
+    merge_cut_pieces,
+    merge_tile_detections,
+    nms,
+    split_into_tiles,
+    tile_starts,
+)
+
+SIZE = (2466, 1000)
+TILES = [(0, 0, 1333, 1000), (1133, 0, 2466, 1000)]
+
+
+def detection(*bboxes):
+    return [np.array(bboxes, np.float32).reshape(-1, 5)]
+
+
+def test_tile_starts_cover_length_with_overlap():
+    starts = tile_starts(2466, 1333, 200)
+
+    assert starts == [0, 1133]
+    assert tile_starts(1000, 1333, 200) == [0]
+
+
+def test_split_into_tiles_returns_views_and_boxes():
+    image = np.zeros((1000, 2466, 3), np.uint8)
+
+    tiles, boxes = split_into_tiles(image, 1333, 200)
+
+    assert [tile.shape[:2] for tile in tiles] == [(1000, 1333), (1000, 1333)]
+    assert boxes == TILES
+
+
+def test_object_detected_whole_in_both_tiles_is_kept_once():
+    merged = merge_tile_detections(
+        [
+            detection([1150, 100, 1300, 150, 0.9]),
+            detection([17, 100, 167, 150, 0.8]),
+        ],
+        TILES,
+        SIZE,
+        0.5,
+    )
+
+    np.testing.assert_allclose(merged[0], [[1150, 100, 1300, 150, 0.9]])
+
+
+def test_object_wider_than_overlap_straddling_seam_is_joined():
+    merged = merge_tile_detections(
+        [
+            detection([1000, 100, 1333, 150, 0.7]),
+            detection([0, 100, 367, 150, 0.9]),
+        ],
+        TILES,
+        SIZE,
+        0.5,
+    )
+
+    np.testing.assert_allclose(merged[0], [[1000, 100, 1500, 150, 0.9]])
+
+
+def test_cut_piece_covered_by_whole_object_is_dropped():
+    merged = merge_tile_detections(
+        [
+            detection([1200, 100, 1333, 150, 0.6]),
+            detection([67, 100, 267, 150, 0.9]),
+        ],
+        TILES,
+        SIZE,
+        0.5,
+    )
+
+    np.testing.assert_allclose(merged[0], [[1200, 100, 1400, 150, 0.9]])
+
+
+def test_cut_pieces_of_different_lines_are_not_joined():
+    merged = merge_tile_detections(
+        [
+            detection([1000, 100, 1333, 150, 0.7]),
+            detection([0, 300, 367, 350, 0.9]),
+        ],
+        TILES,
+        SIZE,
+        0.5,
+    )
+
+    assert len(merged[0]) == 2
+
+
+def test_nms_keeps_best_of_overlapping_bboxes():
+    bboxes = np.array(
+        [
+            [0, 0, 10, 10, 0.5],
+            [1, 1, 11, 11, 0.9],
+            [20, 20, 30, 30, 0.7],
+            [2, 2, 12, 12, 0.8],
+        ],
+        np.float32,
+    )
+
+    kept = nms(bboxes, 0.5)
+
+    np.testing.assert_allclose(
+        kept, [[1, 1, 11, 11, 0.9], [20, 20, 30, 30, 0.7]]
+    )
+
+
+def test_chain_of_pieces_across_two_seams_is_joined():
+    pieces = np.array(
+        [
+            [2000, 100, 2500, 150, 0.6],
+            [1000, 100, 1500, 150, 0.8],
+            [1400, 100, 2100, 150, 0.7],
+            [1000, 300, 1500, 350, 0.9],
+        ],
+        np.float32,
+    )
+
+    merged = merge_cut_pieces(pieces, 0.5)
+
+    np.testing.assert_allclose(
+        merged,
+        [[1000, 100, 2500, 150, 0.8], [1000, 300, 1500, 350, 0.9]],
+    )